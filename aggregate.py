@@ -0,0 +1,174 @@
+"""Collect every session's data files into one columnar store per table, ingesting only what's new or changed.
+
+The store is a directory holding, for each table (study, recognition and source), the trials of every session as one
+structured array in the binary schema of records.encode (<table>.npy, memory-mappable) with the categories of its
+categorical columns (<table>.json). manifest.json records the size, modification time and SHA-1 hash of every file
+ingested, so running the ingest again only reads the files that have been added or rewritten since (e.g. by resuming a
+session). Files are read in parallel, on a pool of processes.
+
+Sessions whose files have been removed from the data directory stay in the store.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import records
+
+# Data file suffix of each table
+tables = {'study': '_study.csv', 'recognition': '_recognition.csv', 'source': '_source.csv'}
+
+
+def manifest_path(store):
+    return os.path.join(store, 'manifest.json')
+
+
+def table_path(store, table):
+    # Path of a table without its extension, as used by records.load_binary
+    return os.path.join(store, table)
+
+
+def read_manifest(store):
+    if not os.path.isfile(manifest_path(store)):
+        return {}
+    with open(manifest_path(store)) as f:
+        return json.load(f)
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def read_session(task):
+    # Runs in a worker process. Categorical columns are read as text, so e.g. subject 001 isn't read as the number 1.
+    table, path = task
+    frame = pd.read_csv(path, dtype=dict((c, str) for c in records.categorical), keep_default_na=False,
+                        na_values=[''])
+    return table, path, file_hash(path), frame
+
+
+def changed_files(data_dir, manifest):
+    # Data files whose size or modification time differ from the manifest's, and their stats
+    changed = []
+    for table, suffix in tables.items():
+        for path in sorted(glob.glob(os.path.join(data_dir, '*' + suffix))):
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            entry = manifest.get(name)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                changed.append((table, path, {'size': stat.st_size, 'mtime': stat.st_mtime}))
+    return changed
+
+
+def load(store, table, mmap_mode='r'):
+    # A table's structured array and categories, memory-mapped by default
+    return records.load_binary(table_path(store, table), mmap_mode)
+
+
+def load_frame(store, table):
+    # A table as a data frame, with its categorical columns as pandas categoricals
+    return records.decode(*load(store, table))
+
+
+def append(store, table, frames):
+    """Add the trials of frames (each one session's table) to a table of the store, replacing the trials of any
+    subject already in it."""
+    if os.path.isfile(table_path(store, table) + '.npy'):
+        old, categories = load(store, table)
+    else:
+        old, categories = None, {}
+
+    new = [records.encode(frame, categories)[0] for frame in frames]
+    # Codes widen if the categories outgrew their type, so encode everything with the final categories' types
+    dtype = records.encode(frames[0].iloc[:0], categories)[0].dtype
+    parts = [data.astype(dtype) for data in new]
+
+    if old is not None:
+        if old.dtype.names != dtype.names:
+            raise ValueError('Table %s has columns %s in the store, but %s in the new files' %
+                             (table, ', '.join(old.dtype.names), ', '.join(dtype.names)))
+        replaced = [categories['subject'].index(str(s)) for frame in frames for s in frame['subject'].unique()]
+        parts.insert(0, old[~np.isin(old['subject'], replaced)].astype(dtype))
+
+    data = np.concatenate(parts)
+    tmp_path = table_path(store, table) + '.tmp.npy'
+    np.save(tmp_path, data)
+    del old
+    if os.path.isfile(table_path(store, table) + '.npy'):
+        os.remove(table_path(store, table) + '.npy')
+    os.rename(tmp_path, table_path(store, table) + '.npy')
+    with open(table_path(store, table) + '.json', 'w') as f:
+        json.dump(categories, f)
+    return len(data)
+
+
+def ingest(data_dir='data', store=None, processes=None):
+    """Bring the store up to date with the session files in data_dir. Returns the names of the files ingested.
+
+    store defaults to a store directory inside data_dir.
+    """
+    store = os.path.join(data_dir, 'store') if store is None else store
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    manifest = read_manifest(store)
+    changed = changed_files(data_dir, manifest)
+    if not changed:
+        return []
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        read = pool.map(read_session, [(table, path) for table, path, _ in changed])
+    finally:
+        pool.close()
+        pool.join()
+
+    # Files that were only touched have the same contents, and just get their new stats recorded
+    stats = dict((path, stat) for _, path, stat in changed)
+    ingested = []
+    for table in tables:
+        frames = []
+        for t, path, sha1, frame in read:
+            name = os.path.basename(path)
+            if t != table:
+                continue
+            stats[path]['sha1'] = sha1
+            if manifest.get(name, {}).get('sha1') != sha1:
+                frames.append(frame)
+                ingested.append(name)
+        if frames:
+            append(store, table, frames)
+    for table, path, stat in changed:
+        stat['table'] = table
+        manifest[os.path.basename(path)] = stat
+
+    # The manifest is written last, so an interrupted ingest reads the same files again next time
+    with open(manifest_path(store), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return ingested
+
+
+if __name__ == "__main__":
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Ingest new and changed session data files into the data store")
+    parser.add_argument("--data", help="Directory containing the session data files", default='data')
+    parser.add_argument("--store", help="Directory of the store. Defaults to a store directory inside the data \
+                                        directory", default=None)
+    parser.add_argument("--processes", help="Number of worker processes. Defaults to the number of cores",
+                        default=None, type=int)
+    args = parser.parse_args()
+
+    ingested = ingest(args.data, args.store, args.processes)
+    store = os.path.join(args.data, 'store') if args.store is None else args.store
+    print("Ingested %i files into %s (%s)" % (len(ingested), store,
+                                              ', '.join('%s %i trials' % (t, len(load(store, t)[0])) for t in tables
+                                                        if os.path.isfile(table_path(store, t) + '.npy'))))
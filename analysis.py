@@ -0,0 +1,315 @@
+"""Statistics for analyzing sessions: signal detection measures, t tests, and a source monitoring model.
+
+Everything works on arrays of any shape, with subjects along the last axis, so the same code analyzes one study or
+thousands of simulated ones at once. scipy isn't needed: normal quantiles use Acklam's rational approximation
+(relative error below 1.2e-9), and t critical values the Cornish-Fisher expansion around the normal quantile (within
+.001 of the exact value from 5 degrees of freedom up).
+
+fit_subjects measures every subject's recognition (d' and criterion in each bias condition) and source memory (a
+multinomial processing tree model fit by expectation maximization), for all subjects at once.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+# Coefficients of Acklam's approximation to the normal quantile function
+_a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02,
+      -3.066479806614716e+01, 2.506628277459239e+00]
+_b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01,
+      -1.328068155288572e+01, 1.0]
+_c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00,
+      4.374664141464968e+00, 2.938163982698783e+00]
+_d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00, 1.0]
+
+
+def norm_ppf(p):
+    p = np.asarray(p, dtype=float)
+    # The tails use p or 1 - p, whichever is smaller, and the sign of the result
+    tail = np.minimum(p, 1 - p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = p - .5
+        r = q * q
+        central = np.polyval(_a, r) * q / np.polyval(_b, r)
+        t = np.sqrt(-2 * np.log(tail))
+        tails = np.sign(q) * -np.polyval(_c, t) / np.polyval(_d, t)
+    return np.where(tail < .02425, tails, central)
+
+
+def t_critical(df, alpha=.05):
+    # Two-sided critical value of Student's t with df degrees of freedom
+    z = norm_ppf(1 - alpha / 2.0)
+    df = np.asarray(df, dtype=float)
+    g = [(z**3 + z) / 4,
+         (5 * z**5 + 16 * z**3 + 3 * z) / 96,
+         (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / 384,
+         (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 92160]
+    return z + sum(gi / df**(i + 1) for i, gi in enumerate(g))
+
+
+def rates(counts, n):
+    # Response rates with the log-linear correction, so rates of 0 and 1 have finite z scores
+    return (np.asarray(counts, dtype=float) + .5) / (np.asarray(n, dtype=float) + 1)
+
+
+def sdt(hits, n_targets, false_alarms, n_lures):
+    # Sensitivity d' and criterion c from counts of hits and false alarms
+    z_hit, z_fa = norm_ppf(rates(hits, n_targets)), norm_ppf(rates(false_alarms, n_lures))
+    return z_hit - z_fa, -(z_hit + z_fa) / 2
+
+
+def t_one_sample(x, mu=0.0):
+    # t statistic and degrees of freedom of the test that the mean of x (along its last axis) is mu
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    return (x.mean(axis=-1) - mu) / (x.std(axis=-1, ddof=1) / np.sqrt(n)), n - 1
+
+
+def t_two_sample(x, y):
+    # t statistic and degrees of freedom of the pooled variance test that x and y have the same mean
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    nx, ny = x.shape[-1], y.shape[-1]
+    pooled = ((nx - 1) * x.var(axis=-1, ddof=1) + (ny - 1) * y.var(axis=-1, ddof=1)) / (nx + ny - 2)
+    return (x.mean(axis=-1) - y.mean(axis=-1)) / np.sqrt(pooled * (1.0 / nx + 1.0 / ny)), nx + ny - 2
+
+
+def significant(t, df, alpha=.05):
+    return np.abs(t) > t_critical(df, alpha)
+
+
+# Response options and sources, as in schedule.py
+options = ['studied', 'unstudied']
+sources = ['m', 'f']
+
+# Parameters of the source monitoring model: detecting an item as studied (or a lure as new), remembering the source
+# of a detected item, guessing the male face as the source, and guessing "studied" for an undetected item with each
+# option safe
+model_params = ['D', 'd', 'g', 'b_studied', 'b_unstudied']
+
+
+def _source_tree():
+    """The processing tree of the source monitoring model (a two-high-threshold model of recognition with source
+    memory for detected items). Returns the names of the response categories, and for each branch of the tree its
+    category and the exponents of every parameter and of its complement in the branch's probability.
+
+    A tree is a stimulus (a target studied with each source, or a lure) with each option safe. A target's categories
+    are its recognition and source test responses, and a lure's its recognition response.
+    """
+    categories, branches = [], []
+    D, d, g = 0, 1, 2
+
+    def branch(category, *factors):
+        # factors are parameter indices, negative for the complement (~p)
+        a, b = np.zeros(len(model_params)), np.zeros(len(model_params))
+        for f in factors:
+            if f >= 0:
+                a[f] += 1
+            else:
+                b[~f] += 1
+        branches.append((categories.index(category), a, b))
+
+    for k, safe in enumerate(options):
+        b = 3 + k
+        for s in sources:
+            tree = [('target', safe, s, r, x) for r in options for x in sources]
+            categories.extend(tree)
+            branch(('target', safe, s, 'studied', s), D, d)
+            branch(('target', safe, s, 'studied', 'm'), D, ~d, g)
+            branch(('target', safe, s, 'studied', 'f'), D, ~d, ~g)
+            branch(('target', safe, s, 'studied', 'm'), ~D, b, g)
+            branch(('target', safe, s, 'studied', 'f'), ~D, b, ~g)
+            branch(('target', safe, s, 'unstudied', 'm'), ~D, ~b, g)
+            branch(('target', safe, s, 'unstudied', 'f'), ~D, ~b, ~g)
+        categories.extend([('lure', safe, 'studied'), ('lure', safe, 'unstudied')])
+        branch(('lure', safe, 'unstudied'), D)
+        branch(('lure', safe, 'studied'), ~D, b)
+        branch(('lure', safe, 'unstudied'), ~D, ~b)
+
+    category = np.array([c for c, _, _ in branches])
+    return categories, category, np.array([a for _, a, _ in branches]), np.array([b for _, _, b in branches])
+
+
+source_categories, _branch_category, _branch_a, _branch_b = _source_tree()
+# Every branch's probability is a product of three factors, taken from the parameters, their complements and 1s
+_branch_factors = np.array([list(np.flatnonzero(a)) + [len(model_params) + i for i in np.flatnonzero(b)] +
+                            [2 * len(model_params)] * int(3 - a.sum() - b.sum())
+                            for a, b in zip(_branch_a, _branch_b)]).T
+_indicator = np.eye(len(source_categories))[_branch_category]
+# The tree each category belongs to, for the fit statistic
+_category_tree = pd.factorize([c[:3] if c[0] == 'target' else c[:2] for c in source_categories])[0]
+
+
+def category_probabilities(theta):
+    # Probabilities of every branch and every response category, for each row of parameters in theta
+    theta = np.asarray(theta, dtype=float)
+    values = np.hstack([theta, 1 - theta, np.ones((len(theta), 1))])
+    branch = values[:, _branch_factors[0]] * values[:, _branch_factors[1]] * values[:, _branch_factors[2]]
+    return branch, branch.dot(_indicator)
+
+
+def fit_source_model(counts, tol=1e-8, max_iter=2000):
+    """Maximum likelihood estimates of the source monitoring model for every row of counts (subjects x
+    source_categories), by expectation maximization run on all the rows at once.
+
+    Returns the parameters (subjects x model_params), NaN for any parameter a subject has no data on (e.g. the
+    guessing rate for the bias condition they weren't in), and each subject's G-squared fit statistic.
+    """
+    counts = np.asarray(counts, dtype=float)
+    theta = np.full((len(counts), len(model_params)), .5)
+    # Only the subjects whose estimates are still changing are updated
+    active = np.arange(len(counts))
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        branch, p = category_probabilities(theta[active])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(p > 0, counts[active] / p, 0)
+        expected = branch * ratio[:, _branch_category]
+        numerator, denominator = expected.dot(_branch_a), expected.dot(_branch_a + _branch_b)
+        new = np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), theta[active])
+        changed = np.abs(new - theta[active]).max(axis=1) >= tol
+        theta[active] = new
+        active = active[changed]
+
+    _, p = category_probabilities(theta)
+    # Parameters with no data stay at their starting value, and aren't estimates
+    denominator = counts[:, _branch_category].dot(_branch_a + _branch_b) if len(counts) else np.zeros(theta.shape)
+    totals = np.zeros((len(counts), _category_tree.max() + 1))
+    for tree in range(totals.shape[1]):
+        totals[:, tree] = counts[:, _category_tree == tree].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(counts > 0, counts * np.log(counts / (totals[:, _category_tree] * p)), 0)
+    theta[denominator == 0] = np.nan
+    return theta, 2 * terms.sum(axis=1)
+
+
+def _fit_chunk(counts):
+    return fit_source_model(counts)
+
+
+def source_counts(recog, source):
+    """Counts of every source model response category for each subject, from recognition and source test tables
+    (e.g. from aggregate.load_frame, or data files read together). Returns the subject IDs and the counts.
+
+    Targets count if both their recognition and source responses were made, so trials after a session ended early
+    are left out.
+    """
+    recog = pd.DataFrame(dict((c, np.asarray(recog[c], dtype=object)) for c in ['subject', 'word', 'type', 'safe',
+                                                                               'recog']))
+    source = pd.DataFrame(dict((c, np.asarray(source[c], dtype=object)) for c in ['subject', 'word', 'source',
+                                                                                'response']))
+    trials = recog.merge(source, on=['subject', 'word'], how='left')
+    subjects, ids = pd.factorize(trials['subject'])
+
+    target = trials['type'].values == 'studied'
+    keys = [('target', safe, s, r, x) if t else ('lure', safe, r)
+            for t, (safe, s, r, x) in zip(target, trials[['safe', 'source', 'recog', 'response']].values)]
+    index = dict((c, i) for i, c in enumerate(source_categories))
+    category = np.array([index.get(k, -1) for k in keys], dtype=int)
+
+    valid = category >= 0
+    counts = np.bincount(subjects[valid] * len(source_categories) + category[valid],
+                         minlength=len(ids) * len(source_categories)).reshape(len(ids), len(source_categories))
+    return np.asarray(ids, dtype=object), counts
+
+
+def recognition_counts(recog, ids):
+    """Hits, targets, false alarms and lures of each subject in ids, in each bias condition, from the recognition
+    test alone. Returns a dict of the four count arrays by safe option.
+
+    Trials count if their recognition response was made, whether or not the session reached the source test.
+    """
+    subject = pd.Index(ids).get_indexer(np.asarray(recog['subject'], dtype=object))
+    response = np.asarray(recog['recog'], dtype=object)
+    target = np.asarray(recog['type'], dtype=object) == 'studied'
+    studied = response == 'studied'
+    answered = pd.notnull(response) & (subject >= 0)
+
+    def count(trials):
+        return np.bincount(subject[trials], minlength=len(ids))
+
+    counts = {}
+    for safe in options:
+        condition = answered & (np.asarray(recog['safe'], dtype=object) == safe)
+        counts[safe] = (count(condition & target & studied), count(condition & target),
+                        count(condition & ~target & studied), count(condition & ~target))
+    return counts
+
+
+def fit_subjects(recog, source, processes=None):
+    """Recognition and source memory measures for every subject, as a data frame indexed by subject ID.
+
+    For each bias condition (named by the safe option): hit and false alarm rates, d' and criterion c, from every
+    recognition test response. Then the proportion of correct source test responses, and the fitted source monitoring
+    model (see _source_tree) with its G-squared, from the targets with both responses. With processes, the model is
+    fit on a pool of that many processes, each fitting a share of the subjects.
+    """
+    ids, counts = source_counts(recog, source)
+    frame = pd.DataFrame(index=pd.Index(ids, name='subject'))
+    recognition = recognition_counts(recog, ids)
+    for safe in options:
+        n_hits, n_targets, n_fas, n_lures = recognition[safe]
+        d, c = sdt(n_hits, n_targets, n_fas, n_lures)
+        missing = (n_targets == 0) | (n_lures == 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frame['hit_rate_' + safe] = np.where(n_targets > 0, n_hits / n_targets.astype(float), np.nan)
+            frame['fa_rate_' + safe] = np.where(n_lures > 0, n_fas / n_lures.astype(float), np.nan)
+        frame['d_' + safe] = np.where(missing, np.nan, d)
+        frame['c_' + safe] = np.where(missing, np.nan, c)
+
+    correct = [i for i, c in enumerate(source_categories) if c[0] == 'target' and c[2] == c[4]]
+    answered = [i for i, c in enumerate(source_categories) if c[0] == 'target']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frame['source_accuracy'] = counts[:, correct].sum(axis=1) / counts[:, answered].sum(axis=1).astype(float)
+
+    if processes and processes > 1 and len(counts) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            fits = pool.map(_fit_chunk, np.array_split(counts, min(processes, len(counts))))
+        finally:
+            pool.close()
+            pool.join()
+        theta, g2 = np.concatenate([t for t, _ in fits]), np.concatenate([g for _, g in fits])
+    else:
+        theta, g2 = fit_source_model(counts)
+    for i, name in enumerate(model_params):
+        frame[name] = theta[:, i]
+    frame['G2'] = g2
+    return frame
+
+
+def read_tables(data_dir='data'):
+    # The recognition and source tables of every session's data files in data_dir, read together
+    tables = []
+    for suffix in ['_recognition.csv', '_source.csv']:
+        frames = [pd.read_csv(path, dtype={'subject': str, 'word': str}, keep_default_na=False, na_values=[''])
+                  for path in sorted(glob.glob(os.path.join(data_dir, '*' + suffix)))]
+        if not frames:
+            raise ValueError('No %s files found in %s' % (suffix, data_dir))
+        tables.append(pd.concat(frames, ignore_index=True))
+    return tables
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Fit recognition and source memory measures for every subject")
+    parser.add_argument("--data", help="Directory containing the session data files", default='data')
+    parser.add_argument("--store", help="Read the data from this data store (see aggregate.py) instead of the data \
+                                        files", default=None)
+    parser.add_argument("--processes", help="Number of processes to fit the source model on", default=None, type=int)
+    parser.add_argument("--out", help="CSV file to write the measures to", default=None)
+    args = parser.parse_args()
+
+    if args.store is not None:
+        import aggregate
+        recog, source = aggregate.load_frame(args.store, 'recognition'), aggregate.load_frame(args.store, 'source')
+    else:
+        recog, source = read_tables(args.data)
+
+    fits = fit_subjects(recog, source, args.processes)
+    print(fits.to_string(float_format='%.3f'))
+    if args.out:
+        fits.to_csv(args.out)
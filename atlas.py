@@ -0,0 +1,166 @@
+"""Preprocess face images into a memory-mappable cache, and load a session's faces into one texture atlas.
+
+preprocess() converts every image in a face directory to a square, power-of-two RGB tile (scaled down to fit if it's
+bigger than the tile size, and padded with the window's gray background), and stores them all in one .npy file with
+an index of which row holds which image. Images that haven't changed since the cache was written are copied over
+instead of converted again, so the cache is cheap to keep up to date for face sets of hundreds of images.
+
+FaceAtlas packs the faces a session uses into the tiles of one texture, drawn with a GratingStim whose spatial
+frequency shows exactly one tile. Switching faces only changes the stimulus phase (its texture coordinates), so no
+image is uploaded to the GPU during the session.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import numpy as np
+
+# Image formats the preprocessor reads
+extensions = ('.bmp', '.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+
+def cache_paths(face_dir='faces', cache_dir=None):
+    cache_dir = os.path.join(face_dir, 'cache') if cache_dir is None else cache_dir
+    return os.path.join(cache_dir, 'faces.npy'), os.path.join(cache_dir, 'faces.json')
+
+
+def next_pow2(n):
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+
+def image_files(face_dir='faces'):
+    return sorted(f for f in os.listdir(face_dir) if f.lower().endswith(extensions))
+
+
+def convert(path, size):
+    # One image as a size x size RGB tile, centered on a gray background
+    from PIL import Image
+    image = Image.open(path).convert('RGB')
+    scale = min(1.0, float(size) / max(image.size))
+    if scale < 1:
+        image = image.resize((max(1, int(round(image.size[0] * scale))), max(1, int(round(image.size[1] * scale)))),
+                             Image.LANCZOS)
+    w, h = image.size
+    tile = np.full((size, size, 3), 128, dtype=np.uint8)
+    top, left = (size - h) // 2, (size - w) // 2
+    tile[top:top + h, left:left + w] = np.asarray(image)
+    return tile
+
+
+def read_index(face_dir='faces', cache_dir=None):
+    data_path, index_path = cache_paths(face_dir, cache_dir)
+    if not (os.path.isfile(data_path) and os.path.isfile(index_path)):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def preprocess(face_dir='faces', size=None, cache_dir=None):
+    """Bring the face cache up to date, and return its index.
+
+    size is the tile size, rounded up to a power of two. If unset, the cache's current tile size is kept, or for a
+    new cache, the smallest power of two that fits every image without scaling it is used.
+    """
+    from PIL import Image
+    data_path, index_path = cache_paths(face_dir, cache_dir)
+    files = image_files(face_dir)
+    mtimes = dict((f, os.path.getmtime(os.path.join(face_dir, f))) for f in files)
+
+    index = read_index(face_dir, cache_dir)
+    if size is None:
+        size = index['size'] if index is not None else \
+            next_pow2(max([max(Image.open(os.path.join(face_dir, f)).size) for f in files] or [1]))
+    size = next_pow2(size)
+    if index is not None and index['size'] != size:
+        index = None
+
+    cached = {} if index is None else index['files']
+    if index is not None and sorted(cached) == files and all(cached[f]['mtime'] == mtimes[f] for f in files):
+        return index
+
+    if not os.path.isdir(os.path.dirname(data_path)):
+        os.makedirs(os.path.dirname(data_path))
+
+    old = np.load(data_path, mmap_mode='r') if index is not None else None
+    tmp_path = data_path + '.tmp.npy'
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(files), size, size, 3))
+    for row, f in enumerate(files):
+        entry = cached.get(f)
+        if entry is not None and entry['mtime'] == mtimes[f]:
+            out[row] = old[entry['row']]
+        else:
+            out[row] = convert(os.path.join(face_dir, f), size)
+    out.flush()
+    del out, old
+
+    if os.path.isfile(data_path):
+        os.remove(data_path)
+    os.rename(tmp_path, data_path)
+    index = {'size': size, 'files': dict((f, {'row': row, 'mtime': mtimes[f]}) for row, f in enumerate(files))}
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    return index
+
+
+class Face(object):
+    # One tile of an atlas, drawn like an ImageStim
+
+    def __init__(self, atlas, name):
+        self.atlas = atlas
+        self.name = name
+
+    def draw(self):
+        self.atlas.draw(self.name)
+
+
+class FaceAtlas(object):
+
+    def __init__(self, win, files, pos=(0, 0), face_dir='faces', cache_dir=None):
+        from psychopy import visual
+
+        names = sorted(set(os.path.basename(f) for f in files))
+        index = preprocess(face_dir, cache_dir=cache_dir)
+        data = np.load(cache_paths(face_dir, cache_dir)[0], mmap_mode='r')
+        size = index['size']
+
+        # Tiles are laid out in a k x k grid, from the bottom left. Texture rows start at the bottom, so each tile is
+        # flipped to come out upright.
+        k = next_pow2(int(np.ceil(np.sqrt(len(names)))))
+        tex = np.zeros((k * size, k * size, 3), dtype=np.float32)
+        self.phases = {}
+        for i, name in enumerate(names):
+            col, row = i % k, i // k
+            tile = np.flipud(data[index['files'][name]['row']]).astype(np.float32) / 127.5 - 1
+            tex[row * size:(row + 1) * size, col * size:(col + 1) * size] = tile
+            # The phase that centers the stimulus on the tile's texture coordinates
+            self.phases[name] = (.5 - (col + .5) / k, .5 - (row + .5) / k)
+
+        self.stim = visual.GratingStim(win, tex=tex, mask=None, units='pix', size=size, sf=1.0 / (k * size),
+                                       pos=(pos[0] * win.size[0] / 2.0, pos[1] * win.size[1] / 2.0))
+
+    def draw(self, name):
+        self.stim.phase = self.phases[name]
+        self.stim.name = name
+        self.stim.draw()
+
+    def faces(self, files):
+        # Stimuli for each of a dict of face image files, e.g. one face per source
+        return dict((key, Face(self, os.path.basename(f))) for key, f in files.items())
+
+
+if __name__ == "__main__":
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Convert the face images into the preprocessed face cache")
+    parser.add_argument("--faces", help="Directory containing the face images", default='faces')
+    parser.add_argument("--size", help="Tile size in pixels, rounded up to a power of two. Images bigger than this \
+                                       are scaled down to fit. Defaults to the size that fits the biggest image",
+                        default=None, type=int)
+    parser.add_argument("--cache", help="Directory the cache is written to. Defaults to a cache directory inside \
+                                        the face directory", default=None)
+    args = parser.parse_args()
+
+    index = preprocess(args.faces, args.size, args.cache)
+    print("%i faces cached as %ix%i tiles in %s" % (len(index['files']), index['size'], index['size'],
+                                                    cache_paths(args.faces, args.cache)[0]))
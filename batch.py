@@ -0,0 +1,124 @@
+"""Compile the schedules for a whole study ahead of time, in parallel.
+
+Every subject gets their own seed, drawn from one study seed, so any subject's schedule can be rebuilt exactly. Subjects
+are counterbalanced in order: consecutive subjects alternate bias conditions (with --bias between), then word
+rotations, then face sets, so every complete cycle of subjects covers each combination once. The plans are written to
+a bundle directory along with an index.json mapping subject IDs to plan files, which main.py --bundle reads.
+"""
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+
+import numpy as np
+import expand
+import lexicon
+import schedule
+
+def subject_seeds(study_seed, n, first=1):
+    # Seeds for subjects first..first+n-1. Subject k always gets the same seed, however many subjects are compiled.
+    rng = np.random.RandomState(study_seed)
+    return rng.randint(0, 2**31 - 1, size=first - 1 + n)[first - 1:].tolist()
+
+
+def counterbalance(bias, n_face_sets, n_rotations=2):
+    # The cells subjects cycle through. bias options vary fastest, then word rotation, then face set.
+    biases = [[b] for b in schedule.options] if bias == 'between' else \
+        [schedule.options] if bias == 'within' else [[bias]]
+    design = expand.Design()
+    design.cross('face_set', range(n_face_sets))
+    design.cross('word_rotation', range(n_rotations))
+    design.cross('bias', range(len(biases)))
+    return [{'face_set': int(f), 'word_rotation': int(w), 'bias': biases[b]}
+            for f, w, b in zip(design.codes['face_set'], design.codes['word_rotation'], design.codes['bias'])]
+
+
+def compile_subject(task):
+    subject, seed, cell, n_items, directory, face_dir, max_run, safe_window = task
+    plan = schedule.compile_session(lexicon.worker_words, subject, cell['bias'], n_items, seed, face_dir=face_dir,
+                                    max_run=max_run, safe_window=safe_window,
+                                    word_rotation=cell['word_rotation'], face_set=cell['face_set'])
+    path = schedule.save_plan(plan, directory)
+    entry = {'file': os.path.basename(path), 'seed': seed}
+    entry.update(cell)
+    return subject, entry
+
+
+def compile_study(words, subjects, directory, study_seed, bias='between', n_items=56, face_dir='faces',
+                  max_run=None, safe_window=None, first=1, processes=None):
+    """Compile and save a plan for each subject ID in subjects, on a pool of processes. Returns the bundle index.
+
+    Subjects are counterbalanced by their position in the study, starting at first, so a bundle can be extended with
+    more subjects later (using the same study seed) without changing the schedules already compiled.
+    """
+    seeds = subject_seeds(study_seed, len(subjects), first)
+    cells = counterbalance(bias, schedule.n_face_sets(face_dir))
+    tasks = [(str(s), seed, cells[(first - 1 + i) % len(cells)], n_items, directory, face_dir, max_run, safe_window)
+             for i, (s, seed) in enumerate(zip(subjects, seeds))]
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    pool = multiprocessing.Pool(processes, initializer=lexicon.init_worker, initargs=(words,))
+    try:
+        compiled = dict(pool.imap_unordered(compile_subject, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Add to the bundle's index, if it already has one
+    index = {'study_seed': study_seed, 'n_items': n_items, 'bias': bias, 'subjects': {}}
+    if os.path.isfile(schedule.index_path(directory)):
+        index = schedule.read_index(directory)
+    index['subjects'].update(compiled)
+    with open(schedule.index_path(directory), 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    return index
+
+
+if __name__ == "__main__":
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Compile the trial schedules for a whole study")
+    parser.add_argument("--subjects", help="Number of subjects to compile schedules for", default=48, type=int)
+    parser.add_argument("--first", help="Number of the first subject. Use to extend an existing bundle",
+                        default=1, type=int)
+    parser.add_argument("--prefix", help="Subject IDs are this prefix followed by the zero-padded subject number",
+                        default='')
+    parser.add_argument("--seed", help="Study seed, which every subject's schedule seed is drawn from",
+                        required=True, type=int)
+    parser.add_argument("--bias", help="Bias manipulation. With between, subjects alternate between the two conditions",
+                        default='between', choices=['between', 'within'] + schedule.options)
+    parser.add_argument("--n_items", help="How many words each subject studies. Must be a multiple of 4.",
+                        default=56, type=int)
+    parser.add_argument("--words", help="Path to plain text file containing word stimuli, or a lexicon directory",
+                        default='words.txt')
+    parser.add_argument("--match", nargs='+', help="Word attributes to match target and lure pools on, with a lexicon",
+                        default=None)
+    parser.add_argument("--max_run", help="Most trials in a row allowed to share a source or word type",
+                        default=None, type=int)
+    parser.add_argument("--safe_window", help="Balance the safe option within every SAFE_WINDOW recognition trials",
+                        default=None, type=int)
+    parser.add_argument("--out", help="Bundle directory the schedules and their index are written to",
+                        default=os.path.join('schedules', 'study'))
+    parser.add_argument("--processes", help="Number of worker processes. Defaults to the number of cores",
+                        default=None, type=int)
+    args = parser.parse_args()
+
+    if args.n_items % 4 != 0:
+        raise ValueError('n_items argument value must be a multiple of 4')
+
+    if args.max_run is not None and args.max_run < 1:
+        raise ValueError('max_run argument value must be at least 1')
+
+    words = lexicon.load_words(args.words, args.match)
+
+    lexicon.check_words(words, args.n_items, args.words)
+
+    subjects = ['%s%03i' % (args.prefix, n) for n in range(args.first, args.first + args.subjects)]
+
+    index = compile_study(words, subjects, args.out, args.seed, args.bias, args.n_items, max_run=args.max_run,
+                          safe_window=args.safe_window, first=args.first, processes=args.processes)
+    print("Compiled %i schedules into %s (%i subjects in the bundle)" % (len(subjects), args.out, len(index['subjects'])))
@@ -1,11 +1,119 @@
-from pandas import DataFrame, concat
-from itertools import product
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def _count(n):
+    # Replication counts have to be whole numbers, even if they were computed with true division
+    if int(n) != n or n < 0:
+        raise ValueError('Cannot replicate a design %s times' % n)
+    return int(n)
+
+
+class Design(object):
+    """A crossed (and optionally nested) design, stored as an integer level code per factor for every cell.
+
+    Cells are ordered like itertools.product: the last factor varies fastest. Nothing is materialized as a DataFrame
+    until to_frame() is called, so large designs only cost one small integer array per factor.
+    """
+
+    def __init__(self, factors=None):
+        self.levels = OrderedDict()
+        self.codes = OrderedDict()
+        self.n = 1
+        if factors:
+            for name, levels in factors.items():
+                self.cross(name, levels)
+
+    def __len__(self):
+        return self.n
+
+    def _take(self, rows):
+        for name in self.codes:
+            self.codes[name] = self.codes[name][rows]
+        self.n = len(rows)
+        return self
+
+    @staticmethod
+    def _dtype(n_levels):
+        return np.min_scalar_type(max(n_levels - 1, 0))
+
+    def cross(self, name, levels):
+        # Cross every existing cell with every level of a new factor
+        levels = list(levels)
+        k = len(levels)
+        self._take(np.repeat(np.arange(self.n), k))
+        self.levels[name] = levels
+        self.codes[name] = np.tile(np.arange(k, dtype=self._dtype(k)), self.n // k if k else 0)
+        return self
+
+    def nest(self, name, levels, within):
+        # Add a factor whose levels depend on the level of the factor it is nested within. levels maps each level of
+        # the parent factor to the list of child levels that go with it.
+        parent = self.levels[within]
+        children = [list(levels.get(p, [])) for p in parent]
+        categories = []
+        lookup = {}
+        local_codes = []
+        for child_levels in children:
+            codes = []
+            for level in child_levels:
+                if level not in lookup:
+                    lookup[level] = len(categories)
+                    categories.append(level)
+                codes.append(lookup[level])
+            local_codes.append(codes)
+
+        counts = np.array([len(c) for c in children], dtype=np.int64)[self.codes[within]]
+        flat = np.concatenate([np.array(c, dtype=np.int64) for c in local_codes]) if categories else np.zeros(0, int)
+        offsets = np.concatenate([[0], np.cumsum([len(c) for c in children])[:-1]])[self.codes[within]]
+
+        rows = np.repeat(np.arange(self.n), counts)
+        position = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self._take(rows)
+        self.levels[name] = categories
+        self.codes[name] = flat[np.repeat(offsets, counts) + position].astype(self._dtype(len(categories)))
+        return self
+
+    def replicate(self, n):
+        # Repeat the whole design n times, one copy after another
+        return self._take(np.tile(np.arange(self.n), _count(n)))
+
+    def weight(self, weights):
+        # Repeat each cell a given number of times. weights is either one count per cell, or maps factor names to
+        # {level: count} dicts, in which case a cell's count is the product of the counts for its levels.
+        if isinstance(weights, dict):
+            counts = np.ones(self.n, dtype=np.int64)
+            for name, level_counts in weights.items():
+                per_level = np.array([_count(level_counts.get(l, 1)) for l in self.levels[name]], dtype=np.int64)
+                counts *= per_level[self.codes[name]]
+        else:
+            counts = np.asarray(weights)
+            if len(counts) != self.n:
+                raise ValueError('Need one weight per cell (%i), got %i' % (self.n, len(counts)))
+            if np.any(counts != np.round(counts)) or np.any(counts < 0):
+                raise ValueError('Cell weights must be non-negative whole numbers')
+            counts = counts.astype(np.int64)
+        return self._take(np.repeat(np.arange(self.n), counts))
+
+    def column(self, name, categorical=True):
+        levels = self.levels[name]
+        if categorical:
+            return pd.Categorical.from_codes(self.codes[name], categories=levels)
+        return np.asarray(levels)[self.codes[name]] if len(levels) else np.array([])
+
+    def to_frame(self, categorical=True):
+        return pd.DataFrame(OrderedDict((name, self.column(name, categorical)) for name in self.codes),
+                            columns=list(self.codes))
 
 
 def expand_grid(factors):
-    rows = product(*factors.values())
-    return DataFrame.from_records(rows, columns=factors.keys())
+    return Design(factors).to_frame(categorical=False)
 
 
 def replicate(df, n, **args):
-    return concat([df]*n, **args)
\ No newline at end of file
+    rows = np.tile(np.arange(len(df)), _count(n))
+    df = df.iloc[rows]
+    if args.get('ignore_index'):
+        df = df.reset_index(drop=True)
+    return df
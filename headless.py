@@ -0,0 +1,451 @@
+"""Run whole sessions of main.run without a display, with a simulated participant making the responses.
+
+install() replaces psychopy (and the parts of pyglet used by responses.py) with stand-ins that draw nothing and run on
+a virtual clock, so waits take no time at all. The simulated participant "sees" each flipped screen: it remembers the
+words studied with a face, and answers the guess, recognition and source questions from its memory, its response
+policy and its RT distribution.
+"""
+from __future__ import print_function
+from collections import deque, namedtuple
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import timeit
+import types
+
+import numpy as np
+import lexicon
+
+# Snapshot of a stimulus, taken when it is drawn
+Drawn = namedtuple('Drawn', ['kind', 'text', 'pos', 'color', 'contrast', 'image'])
+
+# Response button labels, and the response each one stands for
+button_labels = {'Studied': 'studied', 'Not Studied': 'unstudied'}
+source_keys = {'m': 'z', 'f': 'slash'}
+
+# Refresh rate of the stand-in display. Flips wait for the next frame, like they do with vsync on.
+frame_rate = 60.0
+
+
+class Quit(Exception):
+    # Raised by the stand-in for core.quit, so a finished session returns instead of exiting the interpreter
+    pass
+
+
+class Participant(object):
+
+    def __init__(self, memory=.7, source_memory=.5, safe_bias=.5, rt_mean=1.0, rt_sd=.3, seed=None):
+        self.memory = memory
+        self.source_memory = source_memory
+        self.safe_bias = safe_bias
+        # Lognormal RT distribution with the requested mean and standard deviation
+        self.rt_sigma = math.sqrt(math.log(1 + (rt_sd / float(rt_mean)) ** 2))
+        self.rt_mu = math.log(rt_mean) - self.rt_sigma ** 2 / 2
+        self.rng = random.Random(seed)
+        self.studied = set()
+        self.remembered = {}
+
+    def rt(self):
+        return self.rng.lognormvariate(self.rt_mu, self.rt_sigma)
+
+    def observe(self, screen):
+        # A word shown along with a face is being studied
+        word = center_word(screen)
+        faces = [d.image for d in screen if d.kind in ('ImageStim', 'GratingStim')]
+        if word is None or not faces or word in self.studied:
+            return
+        self.studied.add(word)
+        if self.rng.random() < self.memory:
+            source = os.path.basename(faces[0])[0]
+            self.remembered[word] = source if self.rng.random() < self.source_memory else None
+
+    def guess(self, safe):
+        risky = 'unstudied' if safe == 'studied' else 'studied'
+        return safe if self.rng.random() < self.safe_bias else risky
+
+    def button(self, screen):
+        labels = active_buttons(screen)
+        safe = [button_labels[d.text] for d in labels if d.color == 'green']
+        safe = safe[0] if safe else self.rng.choice(list(button_labels.values()))
+
+        word = center_word(screen)
+        if word is None:
+            resp = self.guess(safe)
+        elif word in self.remembered:
+            resp = 'studied'
+        elif word not in self.studied and self.rng.random() < self.memory:
+            resp = 'unstudied'
+        else:
+            resp = self.guess(safe)
+
+        for d in labels:
+            if button_labels[d.text] == resp:
+                return d
+        return None
+
+    def key(self, screen):
+        source = self.remembered.get(center_word(screen))
+        if source is None:
+            source = self.rng.choice(list(source_keys))
+        return source_keys[source]
+
+
+def center_word(screen):
+    # The probe word is the text in the middle of the screen
+    for d in screen:
+        if d.kind == 'TextStim' and tuple(float(p) for p in d.pos) == (0, 0):
+            return d.text
+    return None
+
+
+def active_buttons(screen):
+    return [d for d in screen if d.kind == 'TextStim' and d.text in button_labels and d.contrast == 1]
+
+
+class State(object):
+    # Everything the stand-in modules share: the virtual clock, the participant, and the open windows and keyboards
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, participant):
+        self.now = 0.0
+        self.participant = participant
+        self.windows = []
+        self.keyboards = []
+
+
+state = State()
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.t0 = state.now
+
+    def getTime(self):
+        return state.now - self.t0
+
+    def reset(self, newT=0.0):
+        self.t0 = state.now + newT
+
+
+def get_time():
+    return state.now
+
+
+def wait(secs, hogCPUperiod=0.2):
+    state.now += max(secs, 0)
+
+
+def quit():
+    raise Quit()
+
+
+class Stim(object):
+
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.pos = (0, 0)
+        self.color = 'white'
+        self.contrast = 1
+        self.opacity = 1
+        self.text = None
+        self.image = None
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        self.win.drawn.append(Drawn(type(self).__name__, self.text, self.pos, self.color, self.contrast, self.image))
+
+
+class TextStim(Stim):
+
+    @property
+    def boundingBox(self):
+        # Roughly the size of the rendered text, in pixels
+        return [12 * len(self.text or ''), 24]
+
+
+class Rect(Stim):
+    pass
+
+
+class ImageStim(Stim):
+    pass
+
+
+class GratingStim(Stim):
+    # Face atlas tiles are drawn with a GratingStim, named after the image file of the tile being shown
+
+    def draw(self):
+        self.win.drawn.append(Drawn('GratingStim', None, self.pos, self.color, self.contrast, self.name))
+
+
+class BufferImageStim(object):
+    # Keeps the snapshots of the stimuli it captured, and draws them all again when it is drawn
+
+    def __init__(self, win, buffer='back', rect=(-1, 1, 1, -1), stim=(), **kwargs):
+        self.win = win
+        win.drawn = []
+        for s in stim:
+            s.draw()
+        self.captured = win.drawn
+        win.drawn = []
+
+    def draw(self):
+        self.win.drawn.extend(self.captured)
+
+
+class WinHandle(object):
+
+    def __init__(self, win):
+        self.win = win
+        self.width, self.height = win.size
+        self.handlers = []
+
+    def push_handlers(self, **handlers):
+        self.handlers.append(handlers)
+
+    def dispatch_events(self):
+        self.win.press_key()
+
+
+class Window(object):
+
+    def __init__(self, size=(1280, 768), fullscr=False, **kwargs):
+        self.size = tuple(size)
+        self.winHandle = WinHandle(self)
+        self.drawn = []
+        self.screen = []
+        self.answered = False
+        state.windows.append(self)
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return frame_rate
+
+    def clearBuffer(self, *args, **kwargs):
+        self.drawn = []
+
+    def flip(self, clearBuffer=True):
+        state.now = (math.floor(state.now * frame_rate + 1e-6) + 1) / frame_rate
+        self.screen = self.drawn
+        self.drawn = [] if clearBuffer else list(self.drawn)
+        self.answered = False
+        state.participant.observe(self.screen)
+        return state.now
+
+    def close(self):
+        state.windows.remove(self)
+
+    def _dispatch(self, name, *args):
+        for handlers in self.winHandle.handlers:
+            if name in handlers:
+                handlers[name](*args)
+
+    def click(self):
+        # Click the response button the participant chooses, once per screen
+        if self.answered:
+            return
+        label = state.participant.button(self.screen)
+        if label is None:
+            return
+        self.answered = True
+        state.now += state.participant.rt()
+        x = label.pos[0] * self.size[0] / 2.0 + self.size[0] / 2.0
+        y = label.pos[1] * self.size[1] / 2.0 + self.size[1] / 2.0
+        self._dispatch('on_mouse_press', x, y, 1, 0)
+        self._dispatch('on_mouse_release', x, y, 1, 0)
+
+    def press_key(self):
+        # Answer the source question, if one is showing (a word, and no active response buttons)
+        if self.answered or active_buttons(self.screen) or center_word(self.screen) is None:
+            return
+        self.answered = True
+        state.now += state.participant.rt()
+        keyboard = state.keyboards[-1]
+        keyboard.press(KeyPress(state.participant.key(self.screen), state.now, keyboard.clock.getTime()))
+
+
+class KeyPress(object):
+
+    def __init__(self, name, tDown, rt):
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+
+
+class Keyboard(object):
+
+    def __init__(self, *args, **kwargs):
+        self.keys = deque()
+        self.lock = threading.Lock()
+        # Like psychopy's, the keyboard's clock starts when it's created, so press times aren't on core.getTime()'s
+        self.clock = Clock()
+        self.backend = kwargs.get('backend', 'event')
+        state.keyboards.append(self)
+
+    def press(self, key):
+        with self.lock:
+            self.keys.append(key)
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        # The event backend reads keys by dispatching every window's events, like psychopy.event.getKeys
+        if self.backend != 'ptb':
+            for win in list(state.windows):
+                win.winHandle.dispatch_events()
+        with self.lock:
+            pressed = [k for k in self.keys if keyList is None or k.name in keyList]
+            if clear:
+                self.keys.clear()
+        return pressed
+
+
+class Mouse(object):
+
+    def __init__(self, *args, **kwargs):
+        self.visible = True
+
+    def setPos(self, newPos=(0, 0)):
+        pass
+
+    def setVisible(self, visible):
+        self.visible = visible
+
+    def getPressed(self):
+        return [0, 0, 0]
+
+
+class GlobalKeys(object):
+
+    def add(self, key, func, name=None, **kwargs):
+        pass
+
+    def remove(self, key, modifiers=(), name=None):
+        pass
+
+
+def wait_keys(maxWait=float('inf'), keyList=None, timeStamped=False, **kwargs):
+    return [keyList[0] if keyList else 'space']
+
+
+class EventLoop(object):
+
+    def step(self, timeout=None):
+        for win in state.windows:
+            win.click()
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    # Replace psychopy and pyglet with the stand-ins. Has to happen before main, trials or responses are imported.
+    if getattr(sys.modules.get('psychopy'), 'headless', False):
+        return
+
+    core = _module('psychopy.core', Clock=Clock, getTime=get_time, wait=wait, quit=quit)
+    visual = _module('psychopy.visual', Window=Window, TextStim=TextStim, Rect=Rect, ImageStim=ImageStim,
+                     GratingStim=GratingStim, BufferImageStim=BufferImageStim)
+    event = _module('psychopy.event', Mouse=Mouse, globalKeys=GlobalKeys(), waitKeys=wait_keys,
+                    clearEvents=lambda eventType=None: None, getKeys=lambda *args, **kwargs: [])
+    keyboard = _module('psychopy.hardware.keyboard', Keyboard=Keyboard, KeyPress=KeyPress)
+    hardware = _module('psychopy.hardware', keyboard=keyboard)
+    _module('psychopy', headless=True, core=core, visual=visual, event=event, hardware=hardware)
+
+    mouse = _module('pyglet.window.mouse', LEFT=1, MIDDLE=2, RIGHT=4)
+    window = _module('pyglet.window', mouse=mouse)
+    app = _module('pyglet.app', platform_event_loop=EventLoop())
+    _module('pyglet', app=app, window=window)
+
+
+def run_session(participant, words, subject=None, bias=('studied', 'unstudied'), n_items=96, data_dir='data',
+                seed=None, binary=False, profile=False):
+    # Run one whole session, returning how long it took in (real) seconds
+    install()
+    import main
+    import schedule
+
+    state.reset(participant)
+    # main.run compiles plans with a fresh seed, so a seeded session's plan is compiled from its seed here (in the
+    # background, like main.run's)
+    plan = None
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        plan = lambda: schedule.compile_session(words, subject, bias, n_items, seed=seed)
+
+    start = timeit.default_timer()
+    try:
+        main.run(words, subject=subject, bias=bias, n_items=n_items, data_dir=data_dir, plan=plan, binary=binary,
+                 profile=profile)
+    except Quit:
+        pass
+    return timeit.default_timer() - start
+
+
+if __name__ == "__main__":
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Run sessions of the experiment with a simulated participant")
+    parser.add_argument("--sessions", help="Number of sessions to run", default=1, type=int)
+    parser.add_argument("--n_items", help="How many words are studied in each session", default=56, type=int)
+    parser.add_argument("--bias", help="Which response option is safe", default='between',
+                        choices=['between', 'within', 'studied', 'unstudied'])
+    parser.add_argument("--words", help="Path to plain text file containing word stimuli, or a lexicon directory",
+                        default='words.txt')
+    parser.add_argument("--match", nargs='+', help="Word attributes to match target and lure pools on, with a lexicon",
+                        default=None)
+    parser.add_argument("--memory", help="Probability of remembering a studied word (or rejecting a lure)",
+                        default=.7, type=float)
+    parser.add_argument("--source_memory", help="Probability of remembering the face a remembered word was studied with",
+                        default=.5, type=float)
+    parser.add_argument("--safe_bias", help="Probability of choosing the safe option when guessing",
+                        default=.5, type=float)
+    parser.add_argument("--rt_mean", help="Mean response time, in seconds", default=1.0, type=float)
+    parser.add_argument("--rt_sd", help="Standard deviation of response times, in seconds", default=.3, type=float)
+    parser.add_argument("--seed", help="Seed for the participant and the schedules. Session i uses seed + i",
+                        default=None, type=int)
+    parser.add_argument("--data", help="Directory to write session data to. Defaults to a temporary directory",
+                        default=None)
+    parser.add_argument("--binary", help="If included, also save the trial data in the binary format",
+                        default=False, action="store_true")
+    parser.add_argument("--profile", help="If included, profile each section of the sessions",
+                        default=False, action="store_true")
+    args = parser.parse_args()
+
+    words = lexicon.load_words(args.words, args.match)
+
+    lexicon.check_words(words, args.n_items, args.words)
+
+    data_dir = args.data or tempfile.mkdtemp(prefix='facesource-')
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    times = []
+    for i in range(args.sessions):
+        seed = None if args.seed is None else args.seed + i
+        participant = Participant(memory=args.memory, source_memory=args.source_memory, safe_bias=args.safe_bias,
+                                  rt_mean=args.rt_mean, rt_sd=args.rt_sd, seed=seed)
+        if args.bias == 'between':
+            bias = [random.Random(seed).choice(list(button_labels.values()))]
+        elif args.bias == 'within':
+            bias = ['studied', 'unstudied']
+        else:
+            bias = [args.bias]
+        times.append(run_session(participant, words, subject='sim-%i' % (i + 1), bias=bias, n_items=args.n_items,
+                                 data_dir=data_dir, seed=seed, binary=args.binary,
+                                 profile=args.profile))
+
+    times = np.array(times)
+    print("%i sessions, n_items=%i, data written to %s" % (len(times), args.n_items, data_dir))
+    print("Seconds per session: mean %.3f, median %.3f, min %.3f, max %.3f" %
+          (times.mean(), np.median(times), times.min(), times.max()))
@@ -0,0 +1,60 @@
+"""Summarize the per-trial latency breakdowns sessions export (<subject>_latency.csv), and flag slow bookkeeping.
+
+Each trial's time is split into drawing, waiting for flips, waiting for the response, and the bookkeeping done after
+it (see timing.FrameTimer.span). For every table, the median and 95th percentile of each span are printed, along with
+the trials whose bookkeeping took longer than a frame: those are the ones where recording a response could delay the
+next screen.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import pandas as pd
+import timing
+
+
+def read_latency(paths):
+    # One data frame of the latency files in paths, each a file or a directory of session data files
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*_latency.csv'))) if os.path.isdir(path) else [path])
+    if not files:
+        raise ValueError('No latency files found in %s' % ', '.join(paths))
+    return pd.concat([pd.read_csv(f, dtype={'subject': str}) for f in files], ignore_index=True)
+
+
+def summarize(latency):
+    # Median and 95th percentile of each span, in milliseconds, per table
+    quantiles = latency.groupby('table', sort=False)[timing.span_kinds].quantile([.5, .95]).unstack() * 1000
+    quantiles.columns = ['%s_%s' % (kind, 'median' if q == .5 else 'p95') for kind, q in quantiles.columns]
+    quantiles.insert(0, 'trials', latency.groupby('table', sort=False).size())
+    return quantiles
+
+
+def over_budget(latency, budget):
+    # Trials whose bookkeeping took longer than budget seconds
+    return latency[latency['bookkeeping'] > budget]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Summarize the per-trial latency of sessions, and flag trials whose \
+                                                  bookkeeping went over a frame")
+    parser.add_argument("paths", nargs='*', help="Latency files, or directories of session data files",
+                        default=['data'])
+    parser.add_argument("--rate", help="Frame rate of the display, which sets the budget", default=60.0, type=float)
+    parser.add_argument("--budget", help="Bookkeeping budget in milliseconds. Defaults to one frame", default=None,
+                        type=float)
+    args = parser.parse_args()
+
+    budget = (args.budget / 1000) if args.budget is not None else 1 / args.rate
+    latency = read_latency(args.paths)
+    pd.set_option('display.width', 200)
+    print("Latency (ms) of %i trials:" % len(latency))
+    print(summarize(latency).round(2).to_string())
+
+    slow = over_budget(latency, budget)
+    print("\n%i trials went over the bookkeeping budget of %.2f ms" % (len(slow), budget * 1000))
+    if len(slow):
+        slow = slow.assign(**dict((kind, slow[kind] * 1000) for kind in timing.span_kinds))
+        print(slow.round(2).to_string(index=False))
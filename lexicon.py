@@ -0,0 +1,195 @@
+"""Word lexicons stored as a memory-mapped index of offsets and attributes, for stratified sampling of word pools.
+
+A lexicon is a directory holding words.bin, every word's UTF-8 bytes one after another, and index.npy, a structured
+array with each word's offset and size in words.bin and its numeric attributes (length in letters, plus any numeric
+columns of the table it was built from, like frequency or concreteness). Both files are memory-mapped, so opening a
+lexicon of millions of words costs almost nothing, and sampling only reads the attribute columns it matches on.
+
+A Lexicon can be passed to main.run (and schedule.compile_session) anywhere a list of words can. Instead of taking
+targets and lures in file order, the session draws a target pool and a lure pool matched on the lexicon's attributes.
+"""
+from __future__ import print_function
+import argparse
+import io
+import os
+import numpy as np
+
+# Fields of the index that aren't word attributes
+location_fields = ['offset', 'size']
+
+# Set in each worker process of a pool by init_worker, so the words are only sent to each process once
+worker_words = None
+
+
+def build(source, path):
+    """Build a lexicon from a text file, either one word per line, or a comma or tab delimited table with a header
+    row, the words in the first column and word attributes in the numeric columns after it."""
+    import pandas as pd
+    with io.open(source, encoding='utf-8') as f:
+        first = f.readline()
+    if '\t' in first or ',' in first:
+        table = pd.read_csv(source, sep='\t' if '\t' in first else ',', encoding='utf-8', keep_default_na=False,
+                            na_values=[''])
+        words = table.iloc[:, 0].astype(str).tolist()
+        attributes = table.iloc[:, 1:].select_dtypes(include=[np.number])
+    else:
+        with io.open(source, encoding='utf-8') as f:
+            words = [w for w in f.read().splitlines() if w]
+        attributes = pd.DataFrame(index=range(len(words)))
+
+    encoded = [w.encode('utf-8') for w in words]
+    dtype = [('offset', '<u8'), ('size', '<u4'), ('length', '<u2')] + \
+            [(str(c), '<f4') for c in attributes.columns if c != 'length']
+    index = np.zeros(len(words), dtype=dtype)
+    index['size'] = [len(w) for w in encoded]
+    index['offset'] = np.cumsum(index['size']) - index['size']
+    index['length'] = [len(w) for w in words]
+    for c in attributes.columns:
+        if c != 'length':
+            index[str(c)] = attributes[c].values
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'words.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(os.path.join(path, 'index.npy'), index)
+    return Lexicon(path)
+
+
+def is_lexicon(path):
+    return os.path.isfile(os.path.join(path, 'index.npy'))
+
+
+def load_words(path, match=None, bins=4):
+    # A Lexicon for a lexicon directory, or the list of words in a plain text file
+    if is_lexicon(path):
+        return Lexicon(path, match, bins)
+    if os.path.isdir(path):
+        raise ValueError('%s is a directory, but not a lexicon built with lexicon.py (it has no index.npy)' % path)
+    with open(path, 'r') as f:
+        return f.read().splitlines()
+
+
+def min_words(n_items):
+    # Words a session needs: its targets and lures, 8 practice targets and lures, and the 8 primacy/recency buffer
+    # words on the study list (schedule.n_practice and schedule.n_buffer)
+    return n_items * 2 + 8 * 2 + 8
+
+
+def check_words(words, n_items, path):
+    if len(words) < min_words(n_items):
+        raise ValueError("Not enough stimuli found in %s. Experiment requires at least %i words" %
+                         (path, min_words(n_items)))
+
+
+def init_worker(words):
+    global worker_words
+    worker_words = words
+
+
+def apportion(weights, n):
+    # Split n into whole numbers in proportion to weights, by largest remainders
+    weights = np.asarray(weights, dtype=float)
+    quota = weights * n / weights.sum() if weights.sum() else np.zeros(len(weights))
+    counts = np.floor(quota).astype(int)
+    counts[np.argsort(counts - quota, kind='mergesort')[:n - counts.sum()]] += 1
+    return counts
+
+
+class Lexicon(object):
+
+    def __init__(self, path, match=None, bins=4):
+        # match names the attributes target and lure pools are matched on (all of them if unset), each split into
+        # bins quantile bins
+        self.path = path
+        self.bins = bins
+        self._open()
+        self.match = self.attributes if match is None else list(match)
+        for a in self.match:
+            if a not in self.attributes:
+                raise ValueError('Lexicon %s has no attribute %s' % (path, a))
+
+    def _open(self):
+        self.index = np.load(os.path.join(self.path, 'index.npy'), mmap_mode='r')
+        blob = os.path.join(self.path, 'words.bin')
+        self.blob = np.memmap(blob, dtype=np.uint8, mode='r') if os.path.getsize(blob) else np.zeros(0, np.uint8)
+
+    # Lexicons are sent to worker processes (e.g. by batch.py) by path, and memory-mapped again there
+    def __getstate__(self):
+        return {'path': self.path, 'bins': self.bins, 'match': self.match}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        start = int(self.index['offset'][i])
+        return self.blob[start:start + int(self.index['size'][i])].tobytes().decode('utf-8')
+
+    @property
+    def attributes(self):
+        return [name for name in self.index.dtype.names if name not in location_fields]
+
+    def words(self, rows):
+        return [self[i] for i in rows]
+
+    def strata(self, attributes=None, bins=None):
+        # A stratum number for every word: the cell of the cross of each attribute's quantile bins it falls in.
+        # Words missing an attribute get a bin of their own.
+        attributes = self.match if attributes is None else attributes
+        bins = self.bins if bins is None else bins
+        cells = np.zeros(len(self), dtype=np.int64)
+        for a in attributes:
+            values = np.asarray(self.index[a], dtype=float)
+            missing = np.isnan(values)
+            edges = np.quantile(values[~missing], np.linspace(0, 1, bins + 1)[1:-1]) if (~missing).any() else []
+            codes = np.searchsorted(edges, values, side='right')
+            codes[missing] = bins
+            cells = cells * (bins + 1) + codes
+        return cells
+
+    def sample(self, n_targets, n_lures, rng, attributes=None, bins=None):
+        """Draw rows for a target pool and a lure pool, stratified on the matched attributes.
+
+        Each stratum contributes words in proportion to its size, and its words are split between targets and lures
+        in the same proportion as the pool sizes, so the two pools have the same makeup.
+        """
+        n = n_targets + n_lures
+        if n > len(self):
+            raise ValueError('Lexicon %s has %i words, %i are needed' % (self.path, len(self), n))
+        cells = self.strata(attributes, bins)
+        _, cells = np.unique(cells, return_inverse=True)
+        counts = np.bincount(cells)
+        chosen_counts = apportion(counts, n)
+        target_counts = apportion(chosen_counts, n_targets)
+
+        # Rank the words of each stratum in a random order, and keep the first ones. Adding a random fraction to the
+        # stratum numbers sorts by stratum, then randomly within strata, with a single argsort.
+        order = np.argsort(cells + rng.random_sample(len(cells)))
+        rank = np.empty(len(cells), dtype=np.int64)
+        rank[order] = np.arange(len(cells)) - np.repeat(np.cumsum(counts) - counts, counts)
+        chosen = np.flatnonzero(rank < chosen_counts[cells])
+        is_target = rank[chosen] < target_counts[cells[chosen]]
+        return rng.permutation(chosen[is_target]), rng.permutation(chosen[~is_target])
+
+    def session_words(self, n_targets, n_lures, rng):
+        # Words laid out like a word list for compile_session: the targets, then the lures
+        targets, lures = self.sample(n_targets, n_lures, rng)
+        return self.words(targets) + self.words(lures)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Build a lexicon from a word list or a table of words and their \
+                                                  attributes")
+    parser.add_argument("source", help="Text file with one word per line, or a comma or tab delimited table with a \
+                                        header row, words in the first column and numeric attributes after it")
+    parser.add_argument("path", help="Directory to write the lexicon to")
+    args = parser.parse_args()
+
+    lexicon = build(args.source, args.path)
+    print("Built a lexicon of %i words with attributes %s in %s" % (len(lexicon), ', '.join(lexicon.attributes),
+                                                                     args.path))
@@ -1,9 +1,7 @@
-from psychopy import core, visual, event
-import expand
-import trials
-import pandas as pd
-import numpy as np
-import glob
+# Only light modules are imported up front, so the command line can be checked before psychopy, numpy and pandas are
+# loaded. The rest are imported by run, while the session's schedule is prepared in the background.
+from multiprocessing.pool import ThreadPool
+import timing
 import uuid
 import argparse
 import random
@@ -12,24 +10,155 @@ import os
 
 # Ensure Python's RNG is seeded with current time
 random.seed()
-max_points = 700
 
 
-def run(words, subject=None, bias=('studied', 'unstudied'), n_items=96, fullscreen=False):
+def prepare(words, subject, bias, n_items, resume, data_dir, plan, phases):
+    # Everything the session needs that doesn't need the window: the log of the session being resumed, the session's
+    # plan, and the face cache. Runs in the background while the window opens.
+    with phases.phase('schedule'):
+        import schedule
+        import triallog
+
+        # Pick up the schedules and responses from an earlier, unfinished run of this session
+        logged = triallog.replay(triallog.log_path(subject, data_dir)) if resume else None
+        settings = {}
+        if logged is not None:
+            bias = logged.header['bias']
+            n_items = logged.header['n_items']
+            settings = logged.header.get('settings', {})
+
+        # Compile the session's trial schedules, unless they were prepared ahead of time. A resumed session reloads the
+        # plan file it started with, if it's still there, and recompiles its plan otherwise.
+        if callable(plan):
+            plan = plan()
+        plan_file = logged.header.get('plan_file') if logged is not None else None
+        if plan is None and plan_file is not None and os.path.isfile(plan_file):
+            plan = schedule.load_plan(plan_file)
+            if plan.seed != logged.header.get('seed'):
+                plan = None
+        if plan is None:
+            plan = schedule.compile_session(words, subject, bias, n_items,
+                                            seed=logged.header.get('seed') if logged is not None else None, **settings)
+
+    with phases.phase('faces'):
+        import atlas
+        atlas.preprocess()
+
+    return logged, plan
+
+
+def session_plan(args, words):
+    # Load the session's schedule if it was compiled ahead of time, or compile it now. Resumed sessions get the
+    # schedule they started with from their trial log (see prepare), unless a bundle is given again.
+    import schedule
+    if args.bundle is not None:
+        return schedule.bundle_plan(args.bundle, args.subject)
+    if args.resume is not None:
+        return None
+    seed = args.seed if args.seed is not None else schedule.new_seed()
+    plan_file = schedule.plan_path(args.subject, seed, args.schedules)
+    if os.path.isfile(plan_file):
+        plan = schedule.load_plan(plan_file)
+        schedule.check_plan(plan, None if args.between else args.bias, args.n_items, max_run=args.max_run,
+                            safe_window=args.safe_window)
+        return plan
+    plan = schedule.compile_session(words, args.subject, args.bias, args.n_items, seed,
+                                    max_run=args.max_run, safe_window=args.safe_window)
+    schedule.save_plan(plan, args.schedules)
+    return plan
+
+
+def run(words, subject=None, bias=('studied', 'unstudied'), n_items=96, fullscreen=False, resume=False, data_dir='data',
+        plan=None, phases=None, binary=False, scheme=None, profile=False, report=False):
+    # plan is the session's schedule.Plan, or a function returning one (or None to compile it here), which is called
+    # in the background. phases times the startup, which is logged, and printed once the session is ready to begin if
+    # report is set (the command line sets it, so headless sessions stay quiet). binary also saves each table of
+    # trials in the typed binary format of records.save_binary. scheme is the payoff.Payoff the responses are scored
+    # with (the standard one, if unset). profile writes a report of the time and memory each section of the session
+    # took, and a profile of each, to <subject>_profile.txt/.prof.
 
     if subject is None:
         subject = uuid.uuid4()
+    if phases is None:
+        phases = timing.Phases()
+
+    pool = ThreadPool(1)
+    prepared = pool.apply_async(prepare, (words, subject, bias, n_items, resume, data_dir, plan, phases))
+
+    with phases.phase('imports'):
+        from psychopy import core, visual, event
+        import pandas as pd
+        import trials
+        import responses
+        import records
+        import triallog
+        import stimuli
+        import atlas
+        import writer
+        import payoff
+    if scheme is None:
+        scheme = payoff.standard
 
     # Create a window
-    if fullscreen:
-        win = visual.Window(fullscr=True)
-    else:
-        win = visual.Window([1280, 768])
+    with phases.phase('window'):
+        if fullscreen:
+            win = visual.Window(fullscr=True)
+        else:
+            win = visual.Window([1280, 768])
+
+    with phases.phase('waiting'):
+        logged, plan = prepared.get()
+        pool.close()
+    # The practice phase is skipped if the main study list was reached before
+    resumed = logged is not None and logged.has('study')
+
+    # Data files are written on a background thread, so writing them never delays a flip
+    data_writer = writer.Writer()
+    log = triallog.TrialLog(triallog.log_path(subject, data_dir), writer=data_writer)
+    if logged is None:
+        log.session(subject, plan.bias, plan.n_items, plan.seed, plan.settings, plan.path)
+
+    with phases.phase('stimuli'):
+        # Count screen durations in frames, and time every flip
+        timer = timing.FrameTimer(win)
+
+        # Screens with fixed or few possible contents are captured ahead of time
+        screens = stimuli.ScreenCache(win)
+
+        # Load every face the session uses into one texture
+        session_faces = [f for faces in plan.faces.values() for f in faces.values()]
+        if resumed:
+            session_faces += list(logged.extra['study']['faces'].values())
+        face_atlas = atlas.FaceAtlas(win, session_faces, pos=(0, .4))
+
+        # Render the text stimuli for every word in the session ahead of time
+        study_words = stimuli.WordCache(win, pos=(0, 0))
+        study_words.prerender(stimuli.session_words(plan))
+
+    log.startup(phases.times)
+    if report:
+        print(phases.report())
+
+    # Time and profile each section of the session, if asked to
+    profiler = timing.Profile() if profile else timing.NoProfile()
+    profiler.begin('instructions')
 
     # Create a mouse object
     mouse = event.Mouse()
     event.globalKeys.add(key='q', func=core.quit, name='shutdown')
 
+    # Source test response keys, sampled during the phases with source tests
+    source_keys = responses.KeySampler(win, ['z', 'slash'])
+
+    # What each guess or recognition response earns, as the instructions put it: safe and correct, risky and correct,
+    # safe and wrong, then risky and wrong. The risky correct and safe wrong outcomes are "only" when they're smaller.
+    safe_correct, risky_correct, safe_wrong, risky_wrong = [int(scheme.recog[safe, correct])
+                                                            for safe, correct in [(1, 1), (0, 1), (1, 0), (0, 0)]]
+    recog_outcomes = (payoff.describe(safe_correct),
+                      ('only ' if risky_correct < safe_correct else '') + payoff.describe(risky_correct),
+                      ('only ' if safe_wrong > risky_wrong else '') + payoff.describe(safe_wrong),
+                      payoff.describe(risky_wrong))
+
     intro_text = [
         """Welcome to the experiment! In this experiment, you'll study a list of words to remember, and take two memory tests \
 afterwards.
@@ -38,24 +167,24 @@ On the first test, you will be shown a word, and have to indicate if you studied
 did not study it. You will earn points based on your performance on this test.
         
 You should try to earn as many points as possible. The experiment will end when you complete the entire test OR when \
-you earn 700 points, whichever comes first. 
+you earn %i points, whichever comes first. 
         
 Press the Space Bar to move forward.
-""",
+""" % scheme.max_points,
 
         """On each test trial, one response will be "safe", and the other response will be "risky". "Safe" and "Risky" \
 responses earn you different amounts of points.
         
-If you choose a safe response, and it is the correct answer, you will earn 3 points.
+If you choose a safe response, and it is the correct answer, you will %s.
         
-If you choose a risky response, and it is the correct answer, you will only earn 1 point.
+If you choose a risky response, and it is the correct answer, you will %s.
         
-If you choose a safe response, and it is the wrong answer, you will only lose one point.
+If you choose a safe response, and it is the wrong answer, you will %s.
         
-If you choose a risky response, and it is the wrong answer, you will lose 3 points.
+If you choose a risky response, and it is the wrong answer, you will %s.
         
 Press the Space Bar to move forward.
-""",
+""" % recog_outcomes,
 
         """On each trial, the "safe" response will be shown in green text, and the "risky" response will be shown in red text.
         
@@ -75,8 +204,9 @@ To see how well guessing the "risky" option works, only choose the response show
 Press the Space Bar to begin the first practice round.
 """]
 
-    # Give intro instructions
-    trials.give_instructions(win, event, intro_text)
+    if not resumed:
+        # Give intro instructions
+        trials.give_instructions(screens, event, intro_text, timer)
 
     # Create studied/unstudied "button" components
     studied_guess = visual.TextStim(win, text="Studied", pos=(.75, .75))
@@ -87,6 +217,9 @@ Press the Space Bar to begin the first practice round.
     unstudied_guess_rect = visual.Rect(win, units='pix', pos=[(a * b) / 2 for a, b in zip(unstudied_guess.pos, win.size)],
                                        width=unstudied_guess.boundingBox[0] + 20, height=unstudied_guess.boundingBox[1] + 20,
                                        )
+    guess_buttons = responses.ButtonBox(win, mouse, {'studied': studied_guess_rect, 'unstudied': unstudied_guess_rect})
+    trials.capture_buttons(screens, 'guess', {'studied': studied_guess, 'unstudied': unstudied_guess},
+                           {'studied': studied_guess_rect, 'unstudied': unstudied_guess_rect})
 
     # Text objects for displaying points earned feedback
     guess_points_text = visual.TextStim(win, pos=(0, .75))
@@ -96,13 +229,14 @@ Press the Space Bar to begin the first practice round.
     big_loss = visual.TextStim(win, pos=(0, 0), text="Big Loss! Careful using the risky option", color="red", height=.15,
                                wrapWidth=1.25)
 
+    # Capture the points feedback for every possible guess outcome, the countdown digits and the big loss warning
+    screens.add_text('guess_points', guess_points_text, scheme.recog_values())
+    screens.add_text('countdown', total_points_feedback, range(5, 0, -1))
+    screens.add('big_loss', [big_loss])
+
     # "Make a guess" reminder instructions
     guess_reminder = visual.TextStim(win, pos=(0, .75), text="Make a guess")
-
-    bias_trials = expand.expand_grid({'safe': bias,
-                                      'type': ['studied', 'unstudied']
-                                      })
-    bias_trials = expand.replicate(bias_trials, 8/len(bias_trials), ignore_index=True)
+    screens.add('guess_reminder', [guess_reminder], stimuli.text_rect(win, guess_reminder))
 
     guess_instructions = ["""You'll now do one more round of guessing practice.
 
@@ -111,83 +245,45 @@ This time, guess the safe response shown in green every trial, and see how many
 Press the Space Bar to begin.
 """]
 
-    # GUESSING PRACTICE
-    for practice_round in [1, 2]:
-        total_points = 0
-        if practice_round == 2:
-            trials.give_instructions(win, event, guess_instructions)
-
-        bias_trials = bias_trials.sample(frac=1).reset_index(drop=True)
-        for x in bias_trials.itertuples():
-            # Display guess probe and collect mouse click response
-            guess_reminder.draw()
-            trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-            win.flip()
-            resp, rt, trial_points = trials.guess_response(x, mouse, studied_guess_rect, unstudied_guess_rect)
-            total_points += trial_points
-            mouse.setVisible(0)
-
-            # Display points feedback with guess probe
-            trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-            trials.points_feedback(guess_points_text, trial_points)
-            win.flip()
-            core.wait(1.5)
-
-            # Blank screen ISI
-            win.flip()
-            core.wait(.5)
+    profiler.begin('guess_practice')
+    if not resumed:
+        # GUESSING PRACTICE
+        for practice_round in [1, 2]:
+            total_points = 0
+            if practice_round == 2:
+                trials.give_instructions(screens, event, guess_instructions, timer)
+
+            bias_trials = plan['guess_practice']
+            for x in bias_trials[bias_trials['round'] == practice_round].itertuples():
+                timer.start()
+                # Display guess probe and collect mouse click response
+                with timer.span('draw'):
+                    trials.draw_buttons(screens, 'guess', x)
+                    screens['guess_reminder'].draw()
+                timer.flip()
+                with timer.span('response'):
+                    resp, rt, trial_points = trials.guess_response(x, guess_buttons, scheme)
+                with timer.span('bookkeeping'):
+                    total_points += trial_points
+                    mouse.setVisible(0)
+
+                # Display points feedback with guess probe
+                timer.present(timer.frames(1.5), lambda: trials.draw_guess_feedback(screens, x, trial_points))
+
+                # Blank screen ISI
+                timer.present(timer.frames(.5))
+                log.timing(timer.end('guess_practice', x.Index))
+
+            total_points_feedback.text = 'You earned %i points this round.\n\nPress the space bar to continue.' % total_points
+            total_points_feedback.draw()
+            timer.flip()
+            event.waitKeys(keyList=['space'])
 
-        total_points_feedback.text = 'You earned %i points this round.\n\nPress the space bar to continue.' % total_points
-        total_points_feedback.draw()
-        win.flip()
-        event.waitKeys(keyList=['space'])
+    profiler.begin('study_practice')
+    practice_study_trials = plan['practice_study']
 
-    # Set up pool of face-source stimuli files
-    faces_table = pd.DataFrame({'m': glob.glob("faces/m[1-8].bmp"),
-                               'f': glob.glob("faces/f[1-8].bmp")
-                                })
-    faces_table['m'] = np.random.permutation(faces_table['m'])
-    faces_table['f'] = np.random.permutation(faces_table['f'])
-
-    # Set up target and lure word pools
-    n_targets = 8 + n_items + 8  # 8 practice words, 8 additional words which studied but not tested, to counteract primacy and recency
-    n_lures = 8 + n_items  # 8 practice lures
-    target_pool = words[:n_targets]
-    lure_pool = words[n_targets:(n_targets + n_lures)]
-
-    # Cross source and block
-    practice_study_trials = expand.expand_grid({'source': ['m', 'f'],
-                                                'block': list(range(1, 3)),
-                                                })
-    practice_study_trials.block = practice_study_trials.block.astype(np.int32)
-    # Replicate twice, to make 4 trials per block
-    practice_study_trials = expand.replicate(practice_study_trials, 2, ignore_index=True)
-    # Randomize the order of male/female sources in each block
-    practice_study_trials = practice_study_trials.groupby('block').apply(lambda z: z.sample(frac=1)).reset_index(drop=True)
-    # Add the words to study, chosen image file, and empty response variables to the conditions
-    practice_study_trials = pd.concat([practice_study_trials,
-                                       pd.DataFrame({'word': target_pool[:8],
-                                                     'file': [faces_table.loc[0, y] for y in practice_study_trials.source],
-                                                     }),
-                                       pd.DataFrame(np.full(shape=(practice_study_trials.shape[0], 5), fill_value=np.nan),
-                                                    columns=['response', 'RT', 'correct', 'points', 'test_order'])],
-                                      axis=1)
-    # Put everything in a nice order
-    practice_study_trials = practice_study_trials[['block', 'word', 'source', 'file', 'response', 'RT', 'correct', 'points', 'test_order']]
-    practice_study_trials.set_index(['block', list(range(len(practice_study_trials)))],
-                                    drop=False, inplace=True)
-
-    # Remove words chosen for practice from the target pool
-    target_pool = target_pool[8:]
-    # Shuffle the target pool
-    random.shuffle(target_pool)
-
-    # Make the image stimuli
-    face_stim = {'m': visual.ImageStim(win, image=faces_table.loc[0, 'm'], pos=(0, .4)),
-                 'f': visual.ImageStim(win, image=faces_table.loc[0, 'f'], pos=(0, .4))
-                 }
-    # Make the text stimuli, but don't put the text in yet
-    study_word = visual.TextStim(win, pos=(0, 0))
+    # Make the practice image stimuli
+    face_stim = face_atlas.faces(plan.faces['practice'])
 
     # Make the source responses text
     source_response_opts = visual.TextStim(win, pos=(0, -.8), text="Z = Male                   / = Female",
@@ -199,6 +295,7 @@ Press the Space Bar to begin.
 
     # Make the source points feedback
     source_points_feedback = visual.TextStim(win, pos=(0, -.2))
+    screens.add_text('source_points', source_points_feedback, scheme.source_values())
 
     # Study Practice Instructions
     study_practice_instructions = [
@@ -216,87 +313,62 @@ Press the Space Bar to move forward.
 After you study four word and face pairs, you'll take a test on those four words, and for each one, decide if the word was \
 studied with a male or female face.
     
-On the practice test, press the "z" key for "Male Face" and press the "/" key for "Female Face". You'll earn 2 points for \
-a correct answer, and lose 2 points for an incorrect answer, so try your best! After the test on each word, you'll get a \
+On the practice test, press the "z" key for "Male Face" and press the "/" key for "Female Face". You'll %s for \
+a correct answer, and %s for an incorrect answer, so try your best! After the test on each word, you'll get a \
 reminder about the correct answer.
     
 Press the Space Bar to move forward.
-""",
+""" % (payoff.describe(scheme.source[1]), payoff.describe(scheme.source[0])),
         """Let's begin with a short list of practice words and faces. Press the Space Bar to begin studying the practice list.
 """]
 
-    trials.give_instructions(win, event, study_practice_instructions)
+    if not resumed:
+        trials.give_instructions(screens, event, study_practice_instructions, timer)
 
-    # Study Practice Loop
-    total_points = 0
-    for b in practice_study_trials.index.get_level_values(0).unique():
-        block = practice_study_trials.loc[[b]]
-        # Show stimuli
-        for x in block.itertuples():
-            # Study
-            trials.draw_study_trial(x,  study_word, face_stim)
-            win.flip()
-            core.wait(2)
+        # Preallocate storage for the practice responses
+        practice_study_records = records.TrialRecords(len(practice_study_trials), records.study_columns)
 
-            # Blank screen ISI
-            win.flip()
-            core.wait(.5)
-
-        block = block.sample(frac=1)
-        block['test_order'] = list(range(1, len(block)+1))
-        for x in block.itertuples():
-            # Practice Test
-            trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-            win.flip()
-
-            # Waiting for key response
-            response, rt, correct, points = trials.source_test_response(x)
-            block.loc[x.Index, ['response', 'RT', 'correct', 'points']] = [response, rt, correct, points]
-
-            # Give the accuracy/point feedback
-            total_points += points
-            source_points_feedback.text = str(points)
-            trials.draw_source_feedback(x, source_points_feedback, study_word, face_stim)
-            win.flip()
-            core.wait(2)
-
-            # ISI
-            win.flip()
-            core.wait(.5)
-
-        practice_study_trials.update(block)
-
-    # Creating Recognition Practice trials schema
-    # Create data frame with rows of targets
-    practice_recog_trials = pd.concat([practice_study_trials[['word']].reset_index(drop=True),
-                                       pd.Series(['studied']*len(practice_study_trials), name='type')
-                                       ], axis=1
-                                      )
-    # Add rows of lures (unstudied)
-    practice_recog_trials = pd.concat([practice_recog_trials,
-                                       pd.DataFrame({'word': lure_pool[:len(practice_recog_trials)],
-                                                     'type': ['unstudied']*len(practice_study_trials)})
-                                       ],
-                                      join_axes=[pd.Index(['word', 'type'])],
-                                      ignore_index=True
-                                      )
-    # Remove lures chosen for practice from the lure pool
-    lure_pool = lure_pool[8:]
-    # Shuffle remaining lure pool
-    random.shuffle(lure_pool)
-
-    # Assign items to bias conditions
-    practice_recog_trials = practice_recog_trials.groupby('type', group_keys=False)
-    practice_recog_trials = practice_recog_trials.apply(lambda z:
-                                                        z.assign(safe=np.random.permutation(bias * (len(z) / len(bias))))
-                                                        )
-    # Shuffle trial order
-    practice_recog_trials = practice_recog_trials.sample(frac=1).reset_index(drop=True)
-    # Add empty columns for response variables
-    practice_recog_trials = practice_recog_trials.reindex(columns=practice_recog_trials.columns.tolist() +
-                                                          ['guess', 'guess_RT', 'guess_points',
-                                                           'recog', 'recog_RT', 'recog_points'
-                                                           ])
+        # Study Practice Loop
+        total_points = 0
+        practice_study_rows = list(practice_study_trials.itertuples())
+        source_keys.start()
+        for b, rows in sorted(practice_study_trials.groupby('block').indices.items()):
+            block = [practice_study_rows[i] for i in rows]
+            # Show stimuli
+            for x in block:
+                # Study
+                timer.start()
+                timer.present(timer.frames(2), lambda: trials.draw_study_trial(x, study_words, face_stim))
+
+                # Blank screen ISI
+                timer.present(timer.frames(.5))
+                log.timing(timer.end('practice_study', x.Index))
+
+            for x in sorted(block, key=lambda z: z.test_order):
+                # Practice Test
+                timer.start()
+                with timer.span('draw'):
+                    trials.draw_source_test(x, study_words, source_question_text, source_response_opts)
+                timer.flip()
+
+                # Waiting for key response
+                with timer.span('response'):
+                    response, rt, correct, points = trials.source_test_response(x, source_keys, scheme)
+                with timer.span('bookkeeping'):
+                    practice_study_records.record(x.Index, response, rt, correct, points, x.test_order)
+
+                # Give the accuracy/point feedback
+                total_points += points
+                timer.present(timer.frames(2), lambda: trials.draw_source_feedback(x, screens['source_points', points],
+                                                                                   study_words, face_stim))
+
+                # ISI
+                timer.present(timer.frames(.5))
+                log.timing(timer.end('practice_study_test', x.Index))
+        source_keys.stop()
+
+    profiler.begin('recog_practice')
+    practice_recog_trials = plan['practice_recog']
 
     # Creating visual stimuli for guess & recognition tests
     # Recognition response buttons
@@ -308,9 +380,13 @@ Press the Space Bar to move forward.
     unstudied_recog_rect = visual.Rect(win, units='pix', pos=[(a * b) / 2 for a, b in zip(unstudied_recog.pos, win.size)],
                                        width=unstudied_recog.boundingBox[0] + 20, height=unstudied_recog.boundingBox[1] + 20,
                                        )
+    recog_buttons = responses.ButtonBox(win, mouse, {'studied': studied_recog_rect, 'unstudied': unstudied_recog_rect})
+    trials.capture_buttons(screens, 'recog', {'studied': studied_recog, 'unstudied': unstudied_recog},
+                           {'studied': studied_recog_rect, 'unstudied': unstudied_recog_rect})
 
     # Recognition points feedback
     recog_points_text = visual.TextStim(win, pos=(0, -.75))
+    screens.add_text('recog_points', recog_points_text, scheme.recog_values())
 
     # Recognition Practice Instructions
     recognition_practice_instructions = [
@@ -332,77 +408,35 @@ Press the Space Bar to move forward.
 Press the Space Bar to begin the memory test
 """]
 
-    trials.give_instructions(win, event, recognition_practice_instructions)
-
-    for x in practice_recog_trials.itertuples():
-
-        # Draw the guess response buttons
-        guess_reminder.draw()
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-        win.flip()
-        # Collect guess responses
-        guess, guess_rt, guess_points = trials.guess_response(x, mouse, studied_guess_rect, unstudied_guess_rect)
-        total_points += guess_points
-
-        # "Deactivate" the guess response buttons
-        for y in [studied_guess_rect, unstudied_guess_rect]:
-            y.opacity = .25
-        for y in [studied_guess, unstudied_guess]:
-            y.contrast = .25
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-
-        # Draw the recognition probes
-        trials.draw_recog_stimuli(x, study_word, studied_recog, studied_recog_rect, unstudied_recog, unstudied_recog_rect)
-        win.flip()
-        recog, recog_rt, recog_points = trials.guess_response(x, mouse, studied_recog_rect, unstudied_recog_rect)
-        total_points += recog_points
-
-        # "Deactivate" the recognition response buttons
-        for y in [studied_recog_rect, unstudied_recog_rect]:
-            y.opacity = .25
-        for y in [studied_recog, unstudied_recog]:
-            y.contrast = .25
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-        trials.draw_recog_stimuli(x, study_word, studied_recog, studied_recog_rect, unstudied_recog, unstudied_recog_rect)
-
-        mouse.setVisible(0)
-
-        # Give the feedback
-        guess_points_text.text = str(guess_points)
-        recog_points_text.text = str(recog_points)
-        guess_points_text.draw()
-        recog_points_text.draw()
-        win.flip()
-        core.wait(2)
-
-        if guess_points + recog_points == -6:
-            big_loss.draw()
-            win.flip()
-            core.wait(2)
-
-        t = core.getTime()
-        win.flip()
-        # Save trial data
-        practice_recog_trials.loc[x.Index, ['guess', 'guess_RT', 'guess_points', 'recog', 'recog_RT', 'recog_points']] = \
-            [guess, guess_rt, guess_points, recog, recog_rt, recog_points]
-        # Reset opacity for all 'buttons'
-        for y in [studied_recog_rect, unstudied_recog_rect, studied_guess_rect, unstudied_guess_rect]:
-            y.opacity = 1
-        for y in [studied_recog, unstudied_recog, studied_guess, unstudied_guess]:
-            y.contrast = 1
+    if not resumed:
+        trials.give_instructions(screens, event, recognition_practice_instructions, timer)
 
-        core.wait(.5 - (core.getTime() - t))
+        practice_recog_records = records.TrialRecords(len(practice_recog_trials), records.recog_columns)
+        for row, x in enumerate(practice_recog_trials.itertuples()):
+            timer.start()
 
-    # Source testing
-    practice_source_test = practice_study_trials.copy()
-    practice_source_test[['response', 'RT', 'correct', 'points']] = np.nan
-    practice_source_test = practice_source_test.sample(frac=1)
+            guess, guess_rt, guess_points, recog, recog_rt, recog_points = trials.recog_trial(
+                x, study_words, screens, guess_buttons, recog_buttons, timer, scheme)
+            with timer.span('bookkeeping'):
+                total_points += guess_points + recog_points
 
-    # Source Practice Instructions
-    source_practice_instructions = [
-        "You've earned %i total points so far. Press the Space Bar to continue." % total_points,
+            timer.flip()
+            # Save trial data
+            with timer.span('bookkeeping'):
+                practice_recog_records.record(row, guess, guess_rt, guess_points, recog, recog_rt, recog_points)
 
-        """It's time for one last test. On this final test, you'll be shown each word that you studied, and your job is to \
+            timer.hold(timer.frames(.5))
+            log.timing(timer.end('practice_recog', row))
+
+    profiler.begin('source_practice')
+    practice_source_test = plan['practice_source']
+
+    if not resumed:
+        # Source Practice Instructions
+        source_practice_instructions = [
+            "You've earned %i total points so far. Press the Space Bar to continue." % total_points,
+
+            """It's time for one last test. On this final test, you'll be shown each word that you studied, and your job is to \
 remember if it was studied with a male or a female face".
     
 This test will be just like when  you practiced during the study list. Press the "z" key for "Male Face" and press \
@@ -411,29 +445,34 @@ the "/" key for "Female Face".
 Press the Space Bar to begin the face memory test.
 """]
 
-    trials.give_instructions(win, event, source_practice_instructions)
+        trials.give_instructions(screens, event, source_practice_instructions, timer)
 
-    for x in practice_source_test.itertuples():
-        # Source test probe
-        trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-        win.flip()
+        practice_source_records = records.TrialRecords(len(practice_source_test), records.source_columns)
+        source_keys.start()
+        for row, x in enumerate(practice_source_test.itertuples()):
+            timer.start()
+            # Source test probe
+            with timer.span('draw'):
+                trials.draw_source_test(x, study_words, source_question_text, source_response_opts)
+            timer.flip()
 
-        # Waiting for key response
-        response, rt, correct, points = trials.source_test_response(x)
-        total_points += points
-        practice_source_test.loc[x.Index, ['response', 'RT', 'correct', 'points']] = [response, rt, correct, points]
+            # Waiting for key response
+            with timer.span('response'):
+                response, rt, correct, points = trials.source_test_response(x, source_keys, scheme)
+            with timer.span('bookkeeping'):
+                total_points += points
+                practice_source_records.record(row, response, rt, correct, points)
 
-        # Give accuracy feedback
-        source_points_feedback.text = str(points)
-        trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-        trials.draw_source_feedback(x, source_points_feedback, study_word)
-        win.flip()
-        core.wait(1)
+            # Give accuracy feedback
+            timer.present(timer.frames(1), lambda: trials.draw_source_test_feedback(
+                x, study_words, source_question_text, source_response_opts, screens['source_points', points]))
 
-        # Blank screen ISI
-        win.flip()
-        core.wait(.25)
+            # Blank screen ISI
+            timer.present(timer.frames(.25))
+            log.timing(timer.end('practice_source', row))
+        source_keys.stop()
 
+    profiler.begin('study')
     # Source Practice Instructions
     begin_exp_instructions = [
         """That's the end of the practice phase - it's time for the real experiment.
@@ -444,254 +483,191 @@ If you have any questions, please ask the experimenter now. If not, press the Sp
 """
     ]
 
-    trials.give_instructions(win, event, begin_exp_instructions)
-
-    # Create the study list
-    # Cross the two sources and the 24 blocks
-    study_trials = expand.expand_grid({'source': ['m', 'f'],
-                                       'block': list(range(1, len(target_pool)/4 + 1)),
-                                       })
-    study_trials.block = study_trials.block.astype(np.int32)
-    # Replicate twice, to make 4 trials per block
-    study_trials = expand.replicate(study_trials, 2, ignore_index=True)
-    # Randomize the order of male/female sources in each block
-    study_trials = study_trials.groupby('block').apply(lambda z: z.sample(frac=1)).reset_index(drop=True)
-    # Add the words to study, chosen image file, and empty response variables to the conditions
-    study_trials = pd.concat([study_trials,
-                              pd.DataFrame({'word': target_pool[:len(study_trials)],
-                                            'file': [faces_table.loc[1, y] for y in study_trials.source],
-                                            }),
-                              pd.DataFrame(np.full(shape=(len(study_trials), 5), fill_value=np.nan),
-                                           columns=['response', 'RT', 'correct', 'points', 'test_order'])],
-                             axis=1)
-    # Put everything in a nice order
-    study_trials = study_trials[['block', 'word', 'source', 'file', 'response', 'RT', 'correct', 'points', 'test_order']]
-    study_trials.set_index(['block', list(range(len(study_trials)))],
-                           drop=False, inplace=True)
+    resume_instructions = [
+        """Welcome back! The experiment will continue from where you left off.
+
+Press the Space Bar to continue.
+"""
+    ]
+
+    trials.give_instructions(screens, event, resume_instructions if resumed else begin_exp_instructions, timer)
+
+    if resumed:
+        study_trials = logged.tables['study']
+        study_records = logged.records['study']
+        main_faces = logged.extra['study']['faces']
+    else:
+        study_trials = plan['study']
+        main_faces = plan.faces['main']
+        log.schedule('study', study_trials, faces=main_faces)
+
+        # Preallocate storage for the study list responses
+        study_records = records.TrialRecords(len(study_trials), records.study_columns)
 
     # Update the image stimuli
-    face_stim = {'m': visual.ImageStim(win, image=faces_table.loc[1, 'm'], pos=(0, .4)),
-                 'f': visual.ImageStim(win, image=faces_table.loc[1, 'f'], pos=(0, .4))
-                 }
+    face_stim = face_atlas.faces(main_faces)
 
     # Study Practice Trials Loop
-    total_points = 0
-    for b in study_trials.index.get_level_values(0).unique():
-        if total_points >= max_points:
+    total_points = logged.total_points() if resumed else 0
+    study_rows = list(study_trials.itertuples())
+    source_keys.start()
+    for b, rows in sorted(study_trials.groupby('block').indices.items()):
+        if total_points >= scheme.max_points:
             break
-        block = study_trials.loc[[b]]
+        # Blocks finished before the session was interrupted aren't repeated
+        if study_records.done[rows].all():
+            continue
+        block = [study_rows[i] for i in rows]
         # Show stimuli
-        for x in block.itertuples():
+        for x in block:
             # Study
-            trials.draw_study_trial(x, study_word, face_stim)
-            win.flip()
-            core.wait(2)
+            timer.start()
+            timer.present(timer.frames(2), lambda: trials.draw_study_trial(x, study_words, face_stim))
 
             # Blank screen ISI
-            win.flip()
-            core.wait(.5)
+            timer.present(timer.frames(.5))
+            log.timing(timer.end('study', x.Index))
 
-        block = block.sample(frac=1)
-        block['test_order'] = list(range(1, len(block) + 1))
-        for x in block.itertuples():
+        for x in sorted(block, key=lambda z: z.test_order):
+            if study_records.done[x.Index]:
+                continue
+            timer.start()
 
             # Practice Test
-            trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-            win.flip()
+            with timer.span('draw'):
+                trials.draw_source_test(x, study_words, source_question_text, source_response_opts)
+            timer.flip()
 
             # Waiting for key response
-            response, rt, correct, points = trials.source_test_response(x)
-            block.loc[x.Index, ['response', 'RT', 'correct', 'points']] = [response, rt, correct, points]
-            total_points += points
+            with timer.span('response'):
+                response, rt, correct, points = trials.source_test_response(x, source_keys, scheme)
+            with timer.span('bookkeeping'):
+                study_records.record(x.Index, response, rt, correct, points, x.test_order)
+                log.trial('study', x.Index, response, rt, correct, points, x.test_order)
+                total_points += points
 
             # Give the accuracy/point feedback
-            source_points_feedback.text = str(points)
-            trials.draw_source_feedback(x, source_points_feedback, study_word, face_stim)
-            win.flip()
-            core.wait(2)
+            timer.present(timer.frames(2), lambda: trials.draw_source_feedback(x, screens['source_points', points],
+                                                                               study_words, face_stim))
 
             # ISI
-            win.flip()
-            core.wait(.5)
-
-        study_trials.update(block)
-
-    # Creating Recognition trials schema
-    # We need to drop the first and last block, so we select items from the second and second-to-last blocks
-    targets = study_trials.loc[range(2, study_trials.index.max()[0]), 'word']
-    # Create data frame with rows of targets
-    recog_trials = pd.concat([targets,
-                              pd.Series(['studied'] * len(targets), name='type', index=targets.index)
-                              ],
-                             axis=1
-                             )
-    # Add rows of lures (unstudied)
-    recog_trials = pd.concat([recog_trials,
-                              pd.DataFrame({'word': lure_pool[:len(recog_trials)],
-                                            'type': ['unstudied'] * len(recog_trials)},
-                                           index=recog_trials.index)
-                              ],
-                             join_axes=[pd.Index(['word', 'type'])]
-                             )
-
-    # Assign items to bias conditions
-    recog_trials = recog_trials.groupby('type', group_keys=False)
-    recog_trials = recog_trials.apply(lambda z:
-                                      z.assign(safe=np.random.permutation(bias * (len(z) / len(bias))))
-                                      )
-    recog_trials = recog_trials.sort_index()
-    # Begin the test with the second block of 4 words, but randomly order trials after that
-    recog_trials = pd.concat([recog_trials.loc[[2,2]].sample(frac=1).reset_index(level=1, drop=True),
-                              recog_trials.loc[3:].sample(frac=1).reset_index(level=1, drop=True)
-                              ]
-                             )
-    # Add a trial number index
-    recog_trials['trial'] = range(1, len(recog_trials)+1)
-    recog_trials = recog_trials.set_index('trial', append=True)
-
-    # Add empty columns for response variables
-    recog_trials = recog_trials.reindex(columns=recog_trials.columns.tolist() +
-                                        ['guess', 'guess_RT', 'guess_points',
-                                         'recog', 'recog_RT', 'recog_points'
-                                         ])
-    if total_points < max_points:
+            timer.present(timer.frames(.5))
+            log.timing(timer.end('study_test', x.Index))
+    source_keys.stop()
+
+    profiler.begin('recog')
+    if logged is not None and logged.has('recog'):
+        recog_trials = logged.tables['recog']
+        recog_records = logged.records['recog']
+    else:
+        recog_trials = plan['recog']
+        log.schedule('recog', recog_trials)
+        recog_records = records.TrialRecords(len(recog_trials), records.recog_columns)
+
+    if total_points < scheme.max_points:
 
         total_points_feedback.text = 'You earned %i points during the study list!\n\nPress the space bar to begin the word memory test.' % total_points
         total_points_feedback.draw()
-        win.flip()
+        timer.flip()
         event.waitKeys(keyList=['space'])
 
-        for t in ['5', '4', '3', '2', '1']:
-            total_points_feedback.text = t
-            total_points_feedback.draw()
-            win.flip()
-            core.wait(1)
+        for t in range(5, 0, -1):
+            timer.present(timer.frames(1), screens['countdown', t].draw)
 
-    for x in recog_trials.itertuples():
-        if total_points >= max_points:
+    for row, x in enumerate(recog_trials.itertuples()):
+        if total_points >= scheme.max_points:
             break
+        if recog_records.done[row]:
+            continue
+        timer.start()
+
+        guess, guess_rt, guess_points, recog, recog_rt, recog_points = trials.recog_trial(
+            x, study_words, screens, guess_buttons, recog_buttons, timer, scheme)
+        with timer.span('bookkeeping'):
+            total_points += guess_points + recog_points
 
-        # Draw the guess response buttons
-        guess_reminder.draw()
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-        win.flip()
-        # Collect guess responses
-        guess, guess_rt, guess_points = trials.guess_response(x, mouse, studied_guess_rect, unstudied_guess_rect)
-        total_points += guess_points
-
-        # "Deactivate" the guess response buttons
-        for y in [studied_guess_rect, unstudied_guess_rect]:
-            y.opacity = .25
-        for y in [studied_guess, unstudied_guess]:
-            y.contrast = .25
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-
-        # Draw the recognition probes
-        trials.draw_recog_stimuli(x, study_word, studied_recog, studied_recog_rect, unstudied_recog, unstudied_recog_rect)
-        win.flip()
-        recog, recog_rt, recog_points = trials.guess_response(x, mouse, studied_recog_rect, unstudied_recog_rect)
-        total_points += recog_points
-
-        # "Deactivate" the recognition response buttons
-        for y in [studied_recog_rect, unstudied_recog_rect]:
-            y.opacity = .25
-        for y in [studied_recog, unstudied_recog]:
-            y.contrast = .25
-        trials.draw_guess_stimuli(x, studied_guess, studied_guess_rect, unstudied_guess, unstudied_guess_rect)
-        trials.draw_recog_stimuli(x, study_word, studied_recog, studied_recog_rect, unstudied_recog, unstudied_recog_rect)
-
-        mouse.setVisible(0)
-
-        # Give the feedback
-        guess_points_text.text = str(guess_points)
-        recog_points_text.text = str(recog_points)
-        guess_points_text.draw()
-        recog_points_text.draw()
-        win.flip()
-        core.wait(2)
-
-        if guess_points + recog_points == -6:
-            big_loss.draw()
-            win.flip()
-            core.wait(2)
-
-        t = core.getTime()
-        win.flip()
+        timer.flip()
         # Save trial data
-        recog_trials.loc[x.Index, ['guess', 'guess_RT', 'guess_points', 'recog', 'recog_RT', 'recog_points']] = \
-            [guess, guess_rt, guess_points, recog, recog_rt, recog_points]
-        # Reset opacity for all 'buttons'
-        for y in [studied_recog_rect, unstudied_recog_rect, studied_guess_rect, unstudied_guess_rect]:
-            y.opacity = 1
-        for y in [studied_recog, unstudied_recog, studied_guess, unstudied_guess]:
-            y.contrast = 1
-
-        core.wait(.5 - (core.getTime() - t))
-
-    # Source testing
-    source_test = study_trials.copy()
-    # Again, begin the test with the second block of 4 words, but randomly order trials after that
-    source_test = pd.concat([source_test.loc[[2]].sample(frac=1).reset_index(level=1, drop=True),
-                             source_test.loc[3:source_test.index.get_level_values('block').max()-1].sample(frac=1).reset_index(level=1, drop=True)
-                             ])
-    # Blank out response variables
-    source_test[['response', 'RT', 'correct', 'points']] = np.nan
-    source_test = source_test.drop(labels='test_order',axis=1)  # row number is test order here, so we can remove this column
-
-    # Add a trial number index
-    source_test['trial'] = range(1, len(source_test)+1)
-    source_test = source_test.set_index('trial', append=True)
-
-    if total_points < max_points:
+        with timer.span('bookkeeping'):
+            recog_records.record(row, guess, guess_rt, guess_points, recog, recog_rt, recog_points)
+            log.trial('recog', row, guess, guess_rt, guess_points, recog, recog_rt, recog_points)
+
+        timer.hold(timer.frames(.5))
+        log.timing(timer.end('recog', row))
+
+    profiler.begin('source')
+    if logged is not None and logged.has('source'):
+        source_test = logged.tables['source']
+        source_records = logged.records['source']
+    else:
+        source_test = plan['source']
+        log.schedule('source', source_test)
+        source_records = records.TrialRecords(len(source_test), records.source_columns)
+
+    if total_points < scheme.max_points:
         total_points_feedback.text = 'You earned %i points during the word memory test!\n\nPress the space bar to begin the face memory test.' % total_points
         total_points_feedback.draw()
-        win.flip()
+        timer.flip()
         event.waitKeys(keyList=['space'])
         # Begin Source Test Countdown
-        for t in ['5', '4', '3', '2', '1']:
-            total_points_feedback.text = t
-            total_points_feedback.draw()
-            win.flip()
-            core.wait(1)
+        for t in range(5, 0, -1):
+            timer.present(timer.frames(1), screens['countdown', t].draw)
 
-    for x in source_test.itertuples():
-        if total_points >= max_points:
+    source_keys.start()
+    for row, x in enumerate(source_test.itertuples()):
+        if total_points >= scheme.max_points:
             break
+        if source_records.done[row]:
+            continue
+        timer.start()
 
         # Source test probe
-        trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-        win.flip()
+        with timer.span('draw'):
+            trials.draw_source_test(x, study_words, source_question_text, source_response_opts)
+        timer.flip()
 
         # Waiting for key response
-        response, rt, correct, points = trials.source_test_response(x)
-        total_points += points
-        source_test.loc[x.Index, ['response', 'RT', 'correct', 'points']] = [response, rt, correct, points]
+        with timer.span('response'):
+            response, rt, correct, points = trials.source_test_response(x, source_keys, scheme)
+        with timer.span('bookkeeping'):
+            total_points += points
+            source_records.record(row, response, rt, correct, points)
+            log.trial('source', row, response, rt, correct, points)
 
         # Give the accuracy/point feedback
-        source_points_feedback.text = str(points)
-        trials.draw_source_test(x, study_word, source_question_text, source_response_opts)
-        trials.draw_source_feedback(x, source_points_feedback, study_word)
-        win.flip()
-        core.wait(1)
+        timer.present(timer.frames(1), lambda: trials.draw_source_test_feedback(
+            x, study_words, source_question_text, source_response_opts, screens['source_points', points]))
 
         # Blank screen ISI
-        win.flip()
-        core.wait(.25)
-
-    # Saving the data to CSV
-    study_trials['subject'] = subject
-    study_trials = study_trials[['subject'] + study_trials.columns.tolist()[:-1]]
-    study_trials.to_csv(os.path.join('data', subject + '_study.csv'), index=False, index_label=False)
-
-    recog_trials['subject'] = subject
-    recog_trials = recog_trials[['subject'] + recog_trials.columns.tolist()[:-1]]
-    recog_trials.to_csv(os.path.join('data', subject + '_recognition.csv'), index=False, index_label=False)
-
-    source_test['subject'] = subject
-    source_test = source_test[['subject'] + source_test.columns.tolist()[:-1]]
-    source_test.to_csv(os.path.join('data', subject + '_source.csv'), index=False, index_label=False)
-
-    if total_points >= max_points:
+        timer.present(timer.frames(.25))
+        log.timing(timer.end('source', row))
+    source_keys.stop()
+
+    profiler.begin('export')
+    log.flush()
+
+    # Saving the data to CSV, in the background while the goodbye screen is up
+    study_trials = study_records.into(study_trials)[['block', 'word', 'source', 'file', 'response', 'RT', 'correct',
+                                                    'points', 'test_order']]
+    recog_trials = recog_records.into(recog_trials).drop(['block', 'trial'], axis=1)
+    source_test = source_records.into(source_test).drop('trial', axis=1)
+
+    data_writer.submit(records.save_csv, study_trials, subject, os.path.join(data_dir, subject + '_study.csv'))
+    data_writer.submit(records.save_csv, recog_trials, subject, os.path.join(data_dir, subject + '_recognition.csv'))
+    data_writer.submit(records.save_csv, source_test, subject, os.path.join(data_dir, subject + '_source.csv'))
+    if binary:
+        data_writer.submit(records.save_binary, study_trials, subject, os.path.join(data_dir, subject + '_study'))
+        data_writer.submit(records.save_binary, recog_trials, subject, os.path.join(data_dir, subject + '_recognition'))
+        data_writer.submit(records.save_binary, source_test, subject, os.path.join(data_dir, subject + '_source'))
+
+    # Timing of every trial, including the ones from before the session was interrupted
+    timing_data = pd.DataFrame((logged.timing if logged is not None else []) + timer.trials, columns=timing.columns)
+    data_writer.submit(records.save_csv, timing_data, subject, os.path.join(data_dir, subject + '_timing.csv'))
+    # Latency breakdown of the trials run this time (the buffer isn't logged, so it starts over on resuming)
+    latency_data = pd.DataFrame(timer.latency.records(), columns=timing.latency_columns)
+    data_writer.submit(records.save_csv, latency_data, subject, os.path.join(data_dir, subject + '_latency.csv'))
+
+    if total_points >= scheme.max_points:
         goodbye_text = "You earned %i points and finished the experiment early, great job!" % total_points
     else:
         goodbye_text = "Great work, you finished all the trials in the experiment!"
@@ -699,11 +675,15 @@ If you have any questions, please ask the experimenter now. If not, press the Sp
     goodbye_text += "\n\nPress the Space Bar to close the experiment. Thanks for participating!"
     goodbye = visual.TextStim(win, text=goodbye_text)
     goodbye.draw()
-    win.flip()
+    timer.flip()
+    profiler.end()
+    data_writer.submit(profiler.save, os.path.join(data_dir, subject + '_profile'))
     event.waitKeys(keyList=['space'])
 
-    # Close the window
+    # Close the window, and wait for the data to finish writing
     win.close()
+    log.close()
+    data_writer.close()
 
     # Close PsychoPy
     core.quit()
@@ -711,6 +691,9 @@ If you have any questions, please ask the experimenter now. If not, press the Sp
 
 if __name__ == "__main__":
 
+    phases = timing.Phases()
+    phases.start('arguments')
+
     os.chdir(os.path.dirname(__file__))  # set the working dir. to the dir. where the file being executed is stored
 
     if not os.path.exists('data') and not os.path.isfile('data'):
@@ -737,13 +720,57 @@ if __name__ == "__main__":
                         )
     parser.add_argument("--words",
                         help="Path to plain text file containing word stimuli. Each word should be on its own line. \
-                             Converted to an absolute path, if necessary",
+                             Converted to an absolute path, if necessary. May also be a lexicon directory built with \
+                             lexicon.py, to draw target and lure pools matched on word attributes.",
                         default='words.txt'
                         )
+    parser.add_argument("--match", nargs='+',
+                        help="Word attributes the target and lure pools are matched on, when --words is a lexicon. \
+                             All of the lexicon's attributes are used if unset.",
+                        default=None)
+    parser.add_argument("--seed",
+                        help="Seed for the session's trial schedule. If a schedule for this subject and seed has already \
+                             been compiled, it is loaded instead of compiled again. If unset, a random seed is used.",
+                        default=None, type=int)
+    parser.add_argument("--schedules",
+                        help="Directory where compiled trial schedules are stored",
+                        default='schedules')
+    parser.add_argument("--bundle",
+                        help="Directory of schedules compiled with batch.py. The subject's schedule is looked up in \
+                             its index, and its bias condition and number of items are used.",
+                        default=None)
+    parser.add_argument("--max_run",
+                        help="Most trials in a row allowed to share a face source (study list and source test) or word \
+                             type (recognition test), when compiling a schedule. Unlimited if unset.",
+                        default=None, type=int)
+    parser.add_argument("--safe_window",
+                        help="When compiling a schedule with both bias conditions, balance the safe option within every \
+                             SAFE_WINDOW recognition trials. Unbalanced if unset.",
+                        default=None, type=int)
+    parser.add_argument("--resume", metavar="SUBJECT",
+                        help="Continue an interrupted session for this subject ID from the last trial in its trial log. \
+                             The session's original bias condition and number of items are used.",
+                        default=None)
     parser.add_argument("--fullscreen", help="If included, open a fullscreen PsychoPy window. Otherwise, open a 1280x768 window",
                         default=False, action="store_true")
+    parser.add_argument("--binary", help="If included, also save the trial data in a compact typed binary format (a \
+                                         .npy array and a .json file of categories per table)",
+                        default=False, action="store_true")
+    parser.add_argument("--profile", help="If included, write a report of the time, CPU time and memory each section of \
+                                          the session took, and a cProfile profile of it, to the data directory",
+                        default=False, action="store_true")
     args = parser.parse_args()
 
+    if args.resume is not None:
+        args.subject = args.resume
+        # Without a trial log to resume from, a new session would silently start instead
+        import triallog
+        if not os.path.isfile(triallog.log_path(args.resume, 'data')):
+            raise ValueError('No trial log found for subject %s to resume (%s)' %
+                             (args.resume, triallog.log_path(args.resume, 'data')))
+
+    # A saved schedule for a between subjects session can have either option safe
+    args.between = args.bias == 'between'
     if args.bias == 'between':
         args.bias = random.sample(bias_options, 1)
     elif args.bias == 'within':
@@ -752,15 +779,19 @@ if __name__ == "__main__":
     if args.n_items % 4 != 0:
         raise ValueError('n_items argument value must be a multiple of 4')
 
+    if args.max_run is not None and args.max_run < 1:
+        raise ValueError('max_run argument value must be at least 1')
+
     if not (min_trials <= args.n_items <= max_trials):
         raise ValueError('n_items argument value must be between %i and %i' % (min_trials, max_trials))
 
-    with open(args.words, 'r') as f:
-        words = f.read().splitlines()
+    import lexicon
+    words = lexicon.load_words(args.words, args.match)
+
+    lexicon.check_words(words, args.n_items, args.words)
 
-    # min_stimuli = # of test trials + # of practice test trials and 8 primacy/recency padding items on study list
-    min_stimuli = args.n_items*2 + 8*2 + 8
-    if len(words) < min_stimuli:
-        raise ValueError("Not enough stimuli found in %s. Experiment requires at least %i words" % (args.words, min_stimuli))
+    phases.stop('arguments')
 
-    run(words=words, subject=args.subject, bias=args.bias, n_items=args.n_items, fullscreen=args.fullscreen)
+    run(words=words, subject=args.subject, bias=args.bias, n_items=args.n_items, fullscreen=args.fullscreen,
+        resume=args.resume is not None, plan=lambda: session_plan(args, words), phases=phases, binary=args.binary,
+        profile=args.profile, report=True)
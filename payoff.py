@@ -0,0 +1,154 @@
+"""Payoff matrices: the points each response earns, and the total that ends a session early.
+
+The live trial code scores every response with a Payoff (standard, unless the session is given another), and rescore
+applies any Payoff to recorded sessions, all of them at once, to see how they would have gone under another scheme:
+the points every trial would have earned, and which trials would have been reached before the session ended early.
+"""
+from __future__ import print_function
+import argparse
+import numpy as np
+import pandas as pd
+
+# Arguments of Payoff, in order
+fields = ['safe_correct', 'risky_correct', 'safe_wrong', 'risky_wrong', 'source_correct', 'source_wrong', 'max_points']
+
+
+class Payoff(object):
+
+    def __init__(self, safe_correct=3, risky_correct=1, safe_wrong=-1, risky_wrong=-3, source_correct=2,
+                 source_wrong=-2, max_points=700):
+        # Points for a guess or recognition response, indexed by [chose the safe option, correct]
+        self.recog = np.array([[risky_wrong, risky_correct], [safe_wrong, safe_correct]], dtype=np.int8)
+        # Points for a source response, indexed by [correct]
+        self.source = np.array([source_wrong, source_correct], dtype=np.int8)
+        self.max_points = max_points
+
+    @classmethod
+    def add_arguments(cls, parser):
+        # Add a command line option for each argument, defaulting to the standard scheme's value
+        for name, value in zip(fields, cls.__init__.__defaults__):
+            parser.add_argument("--" + name, help="Defaults to %i" % value, default=value, type=int)
+
+    @classmethod
+    def from_arguments(cls, args):
+        # The scheme set by the options of add_arguments
+        return cls(**dict((name, getattr(args, name)) for name in fields))
+
+    def recog_points(self, response, safe, answer):
+        # Points for one guess or recognition response, or arrays of them
+        response = np.asarray(response, dtype=object)
+        return self.recog[(response == safe).astype(int), (response == answer).astype(int)]
+
+    def source_points(self, correct):
+        return self.source[np.asarray(correct, dtype=int)]
+
+    def recog_values(self):
+        # Every number of points a guess or recognition response can earn, e.g. for capturing the feedback screens
+        return sorted(set(self.recog.flat))
+
+    def source_values(self):
+        return sorted(set(self.source.flat))
+
+    def big_loss(self):
+        # The trial total of a recognition trial whose guess and recognition responses both lost the most
+        return 2 * int(self.recog.min())
+
+
+# The scheme participants are instructed on, unless the session is given another
+standard = Payoff()
+
+
+def describe(points):
+    # How the instructions put winning or losing a number of points, e.g. 'earn 3 points' or 'lose 1 point'
+    points = int(points)
+    return '%s %i point%s' % ('earn' if points >= 0 else 'lose', abs(points), '' if abs(points) == 1 else 's')
+
+
+def _values(column):
+    return np.asarray(column, dtype=object)
+
+
+def rescore(study, recog, source, scheme):
+    """Score the study, recog and source tables of any number of sessions (e.g. from aggregate.load_frame, or
+    concatenated data files) with scheme. Returns copies of the tables with the points replaced, and a ran column
+    marking the trials the session would have run before it ended early, the way main.run checks the total against
+    scheme.max_points.
+
+    Trials that weren't run in the recorded session (because it ended early) earn no points and can't be run under
+    any scheme, since there's no response to score.
+    """
+    study, recog, source = study.copy(), recog.copy(), source.copy()
+    study_done = pd.notnull(study['response']).values
+    recog_done = pd.notnull(recog['guess']).values & pd.notnull(recog['recog']).values
+    source_done = pd.notnull(source['response']).values
+
+    study['points'] = np.where(study_done,
+                               scheme.source_points(_values(study['response']) == _values(study['source'])), 0)
+    source['points'] = np.where(source_done,
+                                scheme.source_points(_values(source['response']) == _values(source['source'])), 0)
+    for column in ['guess', 'recog']:
+        recog[column + '_points'] = np.where(recog_done, scheme.recog_points(_values(recog[column]),
+                                                                             _values(recog['safe']),
+                                                                             _values(recog['type'])), 0)
+
+    # Put every session's trials in the order they're run: the study list tests by block and test order, then the
+    # recognition test, then the source test
+    tables = [study, recog, source]
+    subjects, _ = pd.factorize(np.concatenate([_values(t['subject']) for t in tables]))
+    phase = np.repeat(np.arange(3), [len(t) for t in tables])
+    within = np.concatenate([study['block'].values * (len(study) + 1) + study['test_order'].values,
+                             np.arange(len(recog)), np.arange(len(source))])
+    points = np.concatenate([study['points'].values, recog['guess_points'].values + recog['recog_points'].values,
+                             source['points'].values]).astype(np.int64)
+    done = np.concatenate([study_done, recog_done, source_done])
+    # The total is checked before every test trial, except on the study list, where it's checked before each block
+    checked = np.concatenate([study['test_order'].values == 1, np.ones(len(recog) + len(source), dtype=bool)])
+    order = np.lexsort((within, phase, subjects))
+    points, done, checked, subjects = points[order], done[order], checked[order], subjects[order]
+
+    # Each session's total before every trial. A trial is run if the total hadn't reached max_points at any check
+    # up to and including its own.
+    n = len(order)
+    starts = np.r_[0, np.flatnonzero(np.diff(subjects)) + 1] if n else np.zeros(0, dtype=int)
+    first = np.repeat(starts, np.diff(np.r_[starts, n]))
+    total = np.cumsum(points)
+    before = total - points - (total - points)[first]
+    stops = checked & (before >= scheme.max_points)
+    reached = np.maximum.accumulate(np.where(stops, np.arange(n), -1)) if n else before
+    ran = np.empty(n, dtype=bool)
+    ran[order] = done & (reached < first)
+
+    bounds = np.cumsum([len(t) for t in tables])
+    for t, table_ran in zip(tables, np.split(ran, bounds[:-1])):
+        t['ran'] = table_ran
+    return study, recog, source
+
+
+def totals(study, recog, source, scheme):
+    # Each session's total points and number of trials run under scheme, and whether it ended early
+    study, recog, source = rescore(study, recog, source, scheme)
+    trials = pd.concat([study[['subject', 'ran']].assign(points=study['points']),
+                        recog[['subject', 'ran']].assign(points=recog['guess_points'] + recog['recog_points']),
+                        source[['subject', 'ran']].assign(points=source['points'])], ignore_index=True)
+    trials['subject'] = _values(trials['subject'])
+    trials['points'] = trials['points'].where(trials['ran'], 0)
+    sessions = trials.groupby('subject').agg(points=('points', 'sum'), trials=('ran', 'sum'))
+    sessions['ended_early'] = sessions['points'] >= scheme.max_points
+    return sessions
+
+
+if __name__ == "__main__":
+
+    import aggregate
+
+    parser = argparse.ArgumentParser(description="Rescore the sessions in the data store under another payoff scheme")
+    parser.add_argument("--store", help="Directory of the data store", default='data/store')
+    Payoff.add_arguments(parser)
+    args = parser.parse_args()
+
+    scheme = Payoff.from_arguments(args)
+    sessions = totals(*[aggregate.load_frame(args.store, t) for t in ['study', 'recognition', 'source']],
+                      scheme=scheme)
+    print(sessions.to_string())
+    print("%i sessions: mean %.1f points, %i ended early" % (len(sessions), sessions['points'].mean(),
+                                                             sessions['ended_early'].sum()))
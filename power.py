@@ -0,0 +1,163 @@
+"""Power analysis of the study design, from synthetic studies run on real session schedules.
+
+Each cell of the grid (bias design x n_items x number of subjects) simulates many replications of a whole study.
+Subjects' memory, source memory and safe bias are drawn from normal distributions, and the subjects respond on
+schedules compiled by schedule.compile_session, with the simulated participants of simulate.py. Sessions end early
+at max_points, the way main.run ends them. Every replication is analyzed for three effects:
+
+- bias: the recognition criterion is lower when "studied" is the safe option (a paired t test on each subject's two
+  criteria with the within design, and a two sample t test between the two groups with the between design)
+- recognition: d' is above 0
+- source: source test accuracy is above chance
+
+Power is the proportion of replications in which each effect is significant. Cells run in parallel on a pool of
+processes, each with its own seed drawn from the study seed, so results don't depend on the number of processes.
+"""
+from __future__ import print_function
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import analysis
+import lexicon
+import payoff
+import schedule
+import simulate
+
+designs = ['within', 'between']
+effects = ['bias', 'recognition', 'source']
+
+# Means and standard deviations of the simulated subjects' parameters, the guessing policy, and the early stop total
+default_params = {'memory': .7, 'memory_sd': .1, 'source_memory': .5, 'source_memory_sd': .15, 'safe_bias': .6,
+                  'safe_bias_sd': .1, 'policy': 'independent', 'max_points': 700}
+
+def subject_stats(trials, responses, ran):
+    # Each participant's hits and false alarms with each option safe, and their source test accuracy
+    recog_ran = ran[:, trials.recog_columns]
+    studied = responses['recog'] & recog_ran
+    counts = {}
+    for safe in schedule.options:
+        in_condition = trials.safe_studied == (safe == 'studied')
+        targets, lures = in_condition & trials.target, in_condition & ~trials.target
+        counts[safe] = ((studied & targets).sum(axis=1), (recog_ran & targets).sum(axis=1),
+                        (studied & lures).sum(axis=1), (recog_ran & lures).sum(axis=1))
+    source_ran = ran[:, trials.source_columns]
+    accuracy = (responses['source'] & source_ran).sum(axis=1) / np.maximum(source_ran.sum(axis=1), 1).astype(float)
+    return counts, accuracy
+
+
+def run_cell(task):
+    """Simulate replications of one study design, and return the power to detect each effect.
+
+    Subjects are assigned to a few compiled schedules in turn (alternating bias conditions first with the between
+    design), and every replication simulates all its subjects in one batch per schedule.
+    """
+    design, n_items, n_subjects, replications, seed, params, alpha, n_plans = task
+    rng = np.random.RandomState(seed)
+    scheme = payoff.Payoff(max_points=params['max_points'])
+
+    groups = [schedule.options] if design == 'within' else [[b] for b in schedule.options]
+    plans = [[simulate.Trials(schedule.compile_session(lexicon.worker_words, 'power', bias, n_items,
+                                                       int(rng.randint(0, 2**31 - 1))))
+              for _ in range(n_plans)] for bias in groups]
+
+    def draw(name):
+        values = rng.normal(params[name], params[name + '_sd'], size=(replications, n_subjects))
+        return np.clip(values, 0, 1)
+    memory, source_memory, safe_bias = draw('memory'), draw('source_memory'), draw('safe_bias')
+
+    group = np.arange(n_subjects) % len(groups)
+    plan = (np.arange(n_subjects) // len(groups)) % n_plans
+    d = np.zeros((replications, n_subjects))
+    c = np.zeros((replications, n_subjects, len(schedule.options)))
+    accuracy = np.zeros((replications, n_subjects))
+    for g, group_plans in enumerate(plans):
+        for p, trials in enumerate(group_plans):
+            subjects = np.flatnonzero((group == g) & (plan == p))
+            if not len(subjects):
+                continue
+            params_p = [a[:, subjects].reshape(-1, 1) for a in (memory, source_memory, safe_bias)]
+            responses = simulate.respond(trials, *params_p, policy=params['policy'], rng=rng)
+            _, ran, _ = simulate.score(trials, responses, scheme, 1.0)
+            counts, acc = subject_stats(trials, responses, ran)
+            shape = (replications, len(subjects))
+            accuracy[:, subjects] = acc.reshape(shape)
+            # Every subject's d' pools their trials, and their criterion is computed separately for each condition
+            total = [sum(counts[safe][i] for safe in groups[g]) for i in range(4)]
+            d[:, subjects] = analysis.sdt(*total)[0].reshape(shape)
+            for i, safe in enumerate(schedule.options):
+                if safe in groups[g]:
+                    c[:, subjects, i] = analysis.sdt(*counts[safe])[1].reshape(shape)
+
+    if design == 'within':
+        t, df = analysis.t_one_sample(c[:, :, 1] - c[:, :, 0])
+    else:
+        t, df = analysis.t_two_sample(c[:, group == 1, 1], c[:, group == 0, 0])
+    power = {'bias': analysis.significant(t, df, alpha).mean()}
+    power['recognition'] = analysis.significant(*analysis.t_one_sample(d), alpha=alpha).mean()
+    power['source'] = analysis.significant(*analysis.t_one_sample(accuracy, .5), alpha=alpha).mean()
+    return design, n_items, n_subjects, power
+
+
+def power_grid(words, n_items, n_subjects, designs=designs, replications=200, study_seed=0, params=None, alpha=.05,
+               n_plans=4, processes=None):
+    """Power to detect each effect in every cell of the grid of designs, n_items and numbers of subjects, as a data
+    frame with a row per cell. params sets the means and standard deviations of the subject parameters (see
+    default_params)."""
+    params = dict(default_params, **(params or {}))
+    cells = [(design, n, s) for design in designs for n in n_items for s in n_subjects]
+    seeds = np.random.RandomState(study_seed).randint(0, 2**31 - 1, size=len(cells))
+    tasks = [cell + (replications, int(seed), params, alpha, n_plans) for cell, seed in zip(cells, seeds)]
+
+    pool = multiprocessing.Pool(processes, initializer=lexicon.init_worker, initargs=(words,))
+    try:
+        results = pool.map(run_cell, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = [dict(design=design, n_items=n, subjects=s, **dict(('power_' + e, power[e]) for e in effects))
+            for design, n, s, power in results]
+    return pd.DataFrame(rows, columns=['design', 'n_items', 'subjects'] + ['power_' + e for e in effects])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Estimate the power of study designs from synthetic studies")
+    parser.add_argument("--n_items", nargs='+', help="Numbers of studied words to try", default=[16, 32, 64, 96],
+                        type=int)
+    parser.add_argument("--subjects", nargs='+', help="Numbers of subjects to try", default=[12, 24, 48], type=int)
+    parser.add_argument("--design", nargs='+', help="Bias designs to try", default=designs, choices=designs)
+    parser.add_argument("--replications", help="Synthetic studies per cell of the grid", default=200, type=int)
+    parser.add_argument("--seed", help="Study seed, which every cell's seed is drawn from", required=True, type=int)
+    parser.add_argument("--alpha", help="Significance level of the tests", default=.05, type=float)
+    parser.add_argument("--words", help="Path to plain text file containing word stimuli, or a lexicon directory",
+                        default='words.txt')
+    parser.add_argument("--plans", help="Number of schedules compiled per cell and bias condition", default=4,
+                        type=int)
+    for name in ['memory', 'source_memory', 'safe_bias']:
+        parser.add_argument("--" + name, help="Mean of the subjects' %s" % name, default=default_params[name],
+                            type=float)
+        parser.add_argument("--%s_sd" % name, help="Standard deviation of the subjects' %s" % name,
+                            default=default_params[name + '_sd'], type=float)
+    parser.add_argument("--policy", help="Whether unremembered recognition responses guess again, or repeat the guess",
+                        default='independent', choices=simulate.policies)
+    parser.add_argument("--max_points", help="Total that ends a session early", default=700, type=int)
+    parser.add_argument("--out", help="CSV file to write the power table to", default=None)
+    parser.add_argument("--processes", help="Number of worker processes. Defaults to the number of cores",
+                        default=None, type=int)
+    args = parser.parse_args()
+
+    for n in args.n_items:
+        if n % 4 != 0 or not 8 <= n <= 548:
+            raise ValueError('n_items values must be multiples of 4 between 8 and 548')
+
+    words = lexicon.load_words(args.words)
+    lexicon.check_words(words, max(args.n_items), args.words)
+
+    params = dict((name, getattr(args, name)) for name in default_params)
+    table = power_grid(words, args.n_items, args.subjects, args.design, args.replications, args.seed, params,
+                       args.alpha, args.plans, args.processes)
+    print(table.to_string(index=False))
+    if args.out:
+        table.to_csv(args.out, index=False)
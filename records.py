@@ -0,0 +1,129 @@
+import json
+import numpy as np
+import pandas as pd
+
+# Column layouts for the response variables recorded on each kind of trial
+source_columns = [('response', 'U1'), ('RT', 'f8'), ('correct', '?'), ('points', 'i1')]
+study_columns = source_columns + [('test_order', 'i4')]
+recog_columns = [('guess', 'U9'), ('guess_RT', 'f8'), ('guess_points', 'i1'),
+                 ('recog', 'U9'), ('recog_RT', 'f8'), ('recog_points', 'i1')]
+
+# Schema of the binary export. Categorical columns are stored as codes into a list of the column's categories (-1 for
+# missing), and everything else with the type given here.
+categorical = ['subject', 'word', 'source', 'file', 'response', 'type', 'safe', 'guess', 'recog']
+binary_types = {'block': 'i2', 'trial': 'i2', 'test_order': 'i2', 'round': 'i2',
+                'RT': 'f4', 'guess_RT': 'f4', 'recog_RT': 'f4',
+                'points': 'i1', 'guess_points': 'i1', 'recog_points': 'i1',
+                'correct': '?'}
+
+
+class TrialRecords(object):
+    """Preallocated, fixed-size store for the responses to a list of trials.
+
+    Rows are written by position with a single structured-array assignment, so recording a trial doesn't allocate.
+    Rows which never get written (e.g. after the points threshold ends the session early) are exported as missing.
+    """
+
+    def __init__(self, n, columns):
+        self.names = [name for name, _ in columns]
+        self.data = np.zeros(n, dtype=columns)
+        self.done = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.data)
+
+    def record(self, row, *values):
+        self.data[row] = values
+        self.done[row] = True
+
+    def to_frame(self, index=None):
+        frame = pd.DataFrame(index=index if index is not None else pd.RangeIndex(len(self.data)))
+        for name in self.names:
+            column = pd.Series(self.data[name], index=frame.index)
+            if self.data.dtype[name].kind == 'U':
+                column = column.astype(object)
+            frame[name] = column.where(self.done)
+        return frame
+
+    def into(self, frame):
+        # Replace the response columns of frame, whose rows must be in the same order as the records, with the records
+        frame = frame.copy()
+        for name, column in self.to_frame(frame.index).items():
+            frame[name] = column
+        return frame
+
+
+def save_csv(frame, subject, path):
+    # Write a table of trials to CSV, with the subject ID as its first column
+    frame = frame.copy()
+    frame.insert(0, 'subject', subject)
+    frame.to_csv(path, index=False, index_label=False)
+
+
+def code_type(n):
+    # Smallest signed integer type that holds codes for n categories, and -1
+    return 'i1' if n < 2**7 else 'i2' if n < 2**15 else 'i4'
+
+
+def encode(frame, categories=None):
+    """A structured array of a table of trials in the binary schema, and the categories of its categorical columns.
+
+    New values of a categorical column are added to the end of its list in categories (in sorted order), so codes
+    already given out with the same categories stay valid.
+    """
+    categories = {} if categories is None else categories
+    dtype, columns = [], {}
+    for name in frame.columns:
+        values = frame[name]
+        if name in categorical:
+            values = values.map(lambda v: v if pd.isnull(v) else str(v))
+            known = categories.setdefault(name, [])
+            known.extend(sorted(set(values.dropna()) - set(known)))
+            dtype.append((str(name), code_type(len(known))))
+            columns[name] = pd.Categorical(values, categories=known).codes
+        elif name in binary_types:
+            dtype.append((str(name), binary_types[name]))
+            if binary_types[name] == 'f4':
+                columns[name] = values.astype(float).values
+            else:
+                columns[name] = values.fillna(0).astype(binary_types[name]).values
+        else:
+            raise ValueError('Column %s has no binary type' % name)
+
+    data = np.empty(len(frame), dtype=dtype)
+    for name, values in columns.items():
+        data[name] = values
+    return data, categories
+
+
+def save_binary(frame, subject, path):
+    """Write a table of trials as a structured array to path.npy, with the categories of its categorical columns
+    (including the subject ID) in path.json.
+
+    The array can be memory-mapped by load_binary without parsing or copying anything. Trials that were never run
+    have missing categories, NaN RTs, 0 points and False for correct.
+    """
+    frame = frame.copy()
+    frame.insert(0, 'subject', subject)
+    data, categories = encode(frame)
+    np.save(path + '.npy', data)
+    with open(path + '.json', 'w') as f:
+        json.dump(categories, f)
+
+
+def load_binary(path, mmap_mode='r'):
+    # The structured array and the categories written by save_binary, memory-mapped by default
+    with open(path + '.json') as f:
+        categories = json.load(f)
+    return np.load(path + '.npy', mmap_mode=mmap_mode), categories
+
+
+def decode(data, categories):
+    # A data frame of a binary table, with its categorical columns as pandas categoricals
+    frame = pd.DataFrame(index=pd.RangeIndex(len(data)))
+    for name in data.dtype.names:
+        if name in categories:
+            frame[name] = pd.Categorical.from_codes(data[name], categories[name])
+        else:
+            frame[name] = data[name]
+    return frame
@@ -0,0 +1,170 @@
+from collections import deque
+import threading
+import time
+import pyglet
+from psychopy import core
+
+# How long to block in the OS event queue before checking for a response again. Input events wake the loop up
+# immediately, so this only bounds how often we look when nothing is happening.
+event_timeout = .05
+
+
+def rect_bounds(rect):
+    # Pixel bounds (left, right, bottom, top) of a units='pix' Rect, relative to the center of the window
+    x, y = rect.pos
+    half_w = rect.width / 2.0
+    half_h = rect.height / 2.0
+    return x - half_w, x + half_w, y - half_h, y + half_h
+
+
+class ButtonBox(object):
+    """Collect left clicks on a set of rectangular buttons from window input events, without busy-waiting.
+
+    Button bounds are computed once, when the box is created, so the rects shouldn't be moved or resized afterwards.
+    """
+
+    def __init__(self, win, mouse, buttons):
+        self.win = win
+        self.mouse = mouse
+        self.bounds = [(name,) + rect_bounds(rect) for name, rect in buttons.items()]
+        self._listening = False
+        self._press = None
+        self._released = False
+        win.winHandle.push_handlers(on_mouse_press=self._on_press, on_mouse_release=self._on_release)
+
+    def _to_window_pix(self, x, y):
+        # pyglet reports positions from the bottom left corner, in window coordinates which may not be the same as
+        # framebuffer pixels (e.g. on high DPI displays)
+        handle = self.win.winHandle
+        scale_x = self.win.size[0] / float(handle.width)
+        scale_y = self.win.size[1] / float(handle.height)
+        return (x - handle.width / 2.0) * scale_x, (y - handle.height / 2.0) * scale_y
+
+    def hit_test(self, x, y):
+        for name, left, right, bottom, top in self.bounds:
+            if left <= x <= right and bottom <= y <= top:
+                return name
+        return None
+
+    def _on_press(self, x, y, button, modifiers):
+        t = core.getTime()
+        if not self._listening or self._press is not None or button != pyglet.window.mouse.LEFT:
+            return
+        name = self.hit_test(*self._to_window_pix(x, y))
+        if name is not None:
+            self._press = (name, t)
+
+    def _on_release(self, x, y, button, modifiers):
+        if self._press is not None and button == pyglet.window.mouse.LEFT:
+            self._released = True
+
+    def _wait_for_events(self):
+        pyglet.app.platform_event_loop.step(event_timeout)
+        self.win.winHandle.dispatch_events()
+
+    def wait(self):
+        # Returns the name of the button clicked, and the time of the press relative to when we started listening
+        self._press = None
+        self._released = False
+        self._listening = True
+        onset = core.getTime()
+        try:
+            while self._press is None:
+                self._wait_for_events()
+            # Wait until the mouse is no longer pressed before handing control back
+            while not self._released:
+                self._wait_for_events()
+        finally:
+            self._listening = False
+
+        name, t = self._press
+        return name, t - onset
+
+
+def ptb_available():
+    # Whether psychopy's keyboard can use the psychtoolbox backend, whose key queue can be read from any thread
+    try:
+        import psychtoolbox
+    except ImportError:
+        return False
+    return True
+
+
+class KeySampler(object):
+    """Sample the keyboard at a fixed rate, into a ring buffer of timestamped key presses.
+
+    Presses are read from psychopy's hardware keyboard, which timestamps them when they arrive rather than when we get
+    around to asking for them, so RT resolution doesn't depend on the sampling loop. With the psychtoolbox backend,
+    the keyboard is sampled on a background thread between start() and stop() (e.g. around the source tests), and the
+    main thread blocks in wait() until the sampler hands it a press. Any other backend reads keys by dispatching the
+    windows' events, which pyglet only allows on the main thread, so wait() samples the keyboard itself instead.
+
+    Presses are timed on the keyboard's own clock (their rt), since depending on the keyboard backend, their tDown
+    may not be on core.getTime()'s timebase. Onsets passed to wait() must come from now(), on the same clock.
+    """
+
+    def __init__(self, win, keys, rate=1000, size=64, keyboard=None):
+        self.win = win
+        self.keys = keys
+        self.interval = 1.0 / rate
+        self.buffer = deque(maxlen=size)
+        if keyboard is None:
+            from psychopy.hardware.keyboard import Keyboard
+            keyboard = Keyboard(backend='ptb' if ptb_available() else 'event')
+        self.keyboard = keyboard
+        self.threaded = getattr(keyboard, 'backend', None) == 'ptb'
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.threaded and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def sample(self):
+        # Move any new presses into the buffer
+        pressed = self.keyboard.getKeys(keyList=self.keys, waitRelease=False, clear=True)
+        if pressed:
+            with self._cond:
+                self.buffer.extend((k.name, k.rt) for k in pressed)
+                self._cond.notify_all()
+
+    def run(self):
+        # Runs on the sampler thread
+        while not self._stopping.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def now(self):
+        # The current time on the clock presses are timed with
+        return self.keyboard.clock.getTime()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        with self._cond:
+            self.buffer.clear()
+
+    def wait(self, since):
+        # Returns the first key pressed at or after `since` (a time from now()), and the time it was pressed
+        while True:
+            with self._cond:
+                while self.buffer:
+                    key, t = self.buffer.popleft()
+                    if t >= since:
+                        return key, t
+                if self._thread is not None:
+                    # Keep the window's own event queue moving, so the global shutdown key still works
+                    self.win.winHandle.dispatch_events()
+                    self._cond.wait(event_timeout)
+                    continue
+            # Not sampling on a thread: sampling dispatches the windows' events (and handles the shutdown key) here
+            self.sample()
+            time.sleep(self.interval)
@@ -0,0 +1,280 @@
+"""Compile the full trial schedule for a session, before the session starts.
+
+A plan holds every trial list main.run presents (practice and main study, recognition and source tests, and the
+guessing practice), along with the face images and bias conditions they use. Plans are saved as .npz files keyed by
+subject and seed, so they can be generated ahead of time and loaded instantly when the session begins.
+"""
+import glob
+import json
+import os
+import random
+import numpy as np
+import pandas as pd
+import expand
+import shuffle
+
+# Response options, and the sources words are studied with
+options = ['studied', 'unstudied']
+sources = ['m', 'f']
+
+# Number of practice words and lures, and the number of primacy/recency buffer words on the study list
+n_practice = 8
+n_buffer = 8
+
+
+class Plan(object):
+
+    def __init__(self, subject, seed, bias, n_items, faces, tables, settings=None):
+        self.subject = subject
+        self.seed = seed
+        self.bias = list(bias)
+        self.n_items = n_items
+        self.faces = faces
+        self.tables = tables
+        # The rest of the compile_session arguments the plan was compiled with (max_run, safe_window, word_rotation
+        # and face_set)
+        self.settings = dict(settings or {})
+        # The file the plan was saved to or loaded from, if any
+        self.path = None
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+
+def plan_path(subject, seed, directory='schedules'):
+    return os.path.join(directory, '%s_%i.npz' % (subject, seed))
+
+
+def index_path(directory):
+    return os.path.join(directory, 'index.json')
+
+
+def read_index(directory):
+    with open(index_path(directory)) as f:
+        return json.load(f)
+
+
+def bundle_plan(directory, subject):
+    # Look up a subject's plan in a bundle written by batch.py
+    entry = read_index(directory)['subjects'].get(str(subject))
+    if entry is None:
+        raise ValueError('Subject %s has no schedule in %s' % (subject, directory))
+    return load_plan(os.path.join(directory, entry['file']))
+
+
+def check_plan(plan, bias, n_items, **settings):
+    # Raise a ValueError if a saved plan was compiled with other settings than the session asks for. A bias of None
+    # matches a plan with either option safe (a between subjects plan).
+    wanted = dict(settings, n_items=n_items)
+    found = dict((name, plan.settings.get(name)) for name in settings)
+    found['n_items'] = plan.n_items
+    if bias is not None:
+        wanted['bias'], found['bias'] = sorted(bias), sorted(plan.bias)
+    elif len(plan.bias) != 1:
+        wanted['bias'], found['bias'] = 'between', plan.bias
+    different = [name for name in sorted(wanted) if wanted[name] != found[name]]
+    if different:
+        raise ValueError('The schedule for subject %s and seed %s was compiled with other settings (%s). Use another '
+                         'seed, or remove the saved schedule.' %
+                         (plan.subject, plan.seed, ', '.join('%s=%s, not %s' % (name, found[name], wanted[name])
+                                                               for name in different)))
+
+
+def new_seed():
+    return random.SystemRandom().randint(0, 2**31 - 1)
+
+
+def reorder(df, order):
+    return df.iloc[order].reset_index(drop=True)
+
+
+def test_list(df, rng, first_block=None, max_run=None):
+    # Random order of the trials in df, optionally starting with all the trials from one block and with no more than
+    # max_run trials in a row from the same source
+    groups = np.zeros(len(df), dtype=int) if first_block is None else (df['block'].values != first_block).astype(int)
+    order = shuffle.permute_within(groups, rng)
+    if max_run and 'source' in df:
+        order = shuffle.limit_runs(order, df['source'].values, max_run, rng, groups=groups)
+    return reorder(df, order)
+
+
+def assign_safe(df, bias, rng):
+    # Assign an equal number of items of each type to each bias condition
+    safe = np.empty(len(df), dtype=object)
+    for t in options:
+        rows = np.flatnonzero(df['type'].values == t)
+        safe[rows] = rng.permutation(list(bias) * (len(rows) // len(bias)))
+    return df.assign(safe=safe)
+
+
+def recog_list(df, bias, rng, first_block=None, max_run=None, safe_window=None, tries=100):
+    # Assign items to bias conditions, then put the trials in a random order. Whether the safe option can be balanced
+    # within small windows depends on the order (e.g. windows of 2 need an even number of windows mixing the two word
+    # types), so orders it can't be balanced in are drawn again, up to tries times.
+    df = assign_safe(df, bias, rng)
+    groups = np.zeros(len(df), dtype=int) if first_block is None else (df['block'].values != first_block).astype(int)
+    for attempt in range(tries):
+        order = shuffle.permute_within(groups, rng)
+        if max_run:
+            order = shuffle.limit_runs(order, df['type'].values, max_run, rng, groups=groups)
+        ordered = reorder(df, order)
+        if not safe_window or len(set(bias)) < 2:
+            return ordered
+        try:
+            ordered['safe'] = shuffle.balance_windows(ordered['safe'].values.astype(str), safe_window, rng,
+                                                      groups=ordered['type'].values).astype(object)
+            return ordered
+        except ValueError:
+            if attempt == tries - 1:
+                raise
+
+
+def study_list(words, n_blocks, faces, rng, max_run=None):
+    # Cross source and block, replicated twice to make 4 trials per block
+    trials = expand.expand_grid({'source': sources, 'block': list(range(1, n_blocks + 1))})
+    trials = expand.replicate(trials, 2, ignore_index=True)
+    blocks = trials['block'].values.astype(np.int32)
+    # Randomize the order of male/female sources in each block, with no more than max_run of the same source in a row
+    order = shuffle.permute_within(blocks, rng)
+    if max_run:
+        order = shuffle.limit_runs(order, trials['source'].values, max_run, rng, groups=blocks)
+    trials = reorder(trials, order)
+    trials['block'] = blocks[order]
+    trials['word'] = words[:len(trials)]
+    trials['file'] = [faces[s] for s in trials['source']]
+    # Randomize the order the words in each block are tested in, after the block is studied
+    test = shuffle.permute_within(trials['block'].values, rng)
+    block_start = np.searchsorted(trials['block'].values[test], trials['block'].values[test])
+    test_order = np.empty(len(trials), dtype=np.int32)
+    test_order[test] = np.arange(len(trials)) - block_start + 1
+    trials['test_order'] = test_order
+    return trials[['block', 'word', 'source', 'file', 'test_order']]
+
+
+def face_files(face_dir='faces'):
+    # The face images for each source, in sorted order
+    return dict((s, sorted(glob.glob(os.path.join(face_dir, '%s[0-9]*.bmp' % s)))) for s in sources)
+
+
+def n_face_sets(face_dir='faces'):
+    # Each face set is a practice face and a main face for every source
+    return min(len(f) for f in face_files(face_dir).values()) // 2
+
+
+def compile_session(words, subject, bias=('studied', 'unstudied'), n_items=96, seed=None, face_dir='faces',
+                    max_run=None, safe_window=None, word_rotation=0, face_set=None):
+    # max_run limits how many trials in a row can have the same source (study list and source tests) or type
+    # (recognition tests). safe_window balances the safe option within every safe_window recognition trials, when
+    # both options are used as the safe one.
+    # word_rotation shifts the main word pool by n_items words per rotation, so that counterbalanced subjects study
+    # the words other subjects see as lures. face_set picks fixed practice and main faces (faces 2k+1 and 2k+2 of
+    # each source) instead of random ones.
+
+    if seed is None:
+        seed = new_seed()
+    rng = np.random.RandomState(seed)
+
+    # Set up pool of face-source stimuli files. Row 0 is used for practice, row 1 for the main study list.
+    files = face_files(face_dir)
+    if face_set is None:
+        faces_table = pd.DataFrame(dict((s, rng.permutation(files[s])) for s in sources))
+    else:
+        faces_table = pd.DataFrame(dict((s, files[s][2 * face_set:2 * face_set + 2]) for s in sources))
+    faces = {'practice': dict((s, faces_table.loc[0, s]) for s in sources),
+             'main': dict((s, faces_table.loc[1, s]) for s in sources)}
+
+    # Set up target and lure word pools
+    n_targets = n_practice + n_items + n_buffer
+    n_lures = n_practice + n_items
+    # A lexicon draws matched target and lure pools, laid out like a word list
+    if hasattr(words, 'session_words'):
+        words = words.session_words(n_targets, n_lures, rng)
+    target_pool = list(words[:n_targets])
+    lure_pool = list(words[n_targets:(n_targets + n_lures)])
+    # The first words in each pool are used for practice, and the rest are shuffled
+    practice_targets, target_pool = target_pool[:n_practice], target_pool[n_practice:]
+    practice_lures, lure_pool = lure_pool[:n_practice], lure_pool[n_practice:]
+    if word_rotation:
+        pool = target_pool + lure_pool
+        shift = (word_rotation * n_items) % len(pool)
+        pool = pool[shift:] + pool[:shift]
+        target_pool, lure_pool = pool[:len(target_pool)], pool[len(target_pool):]
+    target_pool = list(rng.permutation(target_pool))
+    lure_pool = list(rng.permutation(lure_pool))
+
+    tables = {}
+
+    # Guessing practice: 8 guesses crossing the bias conditions with the correct answer, in two shuffled rounds
+    bias_trials = expand.expand_grid({'safe': list(bias), 'type': options})
+    bias_trials = expand.replicate(bias_trials, 8 // len(bias_trials), ignore_index=True)
+    rounds = [reorder(bias_trials, rng.permutation(len(bias_trials))).assign(round=r) for r in [1, 2]]
+    tables['guess_practice'] = pd.concat(rounds, ignore_index=True)[['round', 'safe', 'type']]
+
+    # Practice study list, with its recognition and source tests
+    practice_study = study_list(practice_targets, n_practice // 4, faces['practice'], rng, max_run)
+    tables['practice_study'] = practice_study
+
+    practice_recog = pd.DataFrame({'word': list(practice_study['word']) + practice_lures,
+                                   'type': ['studied'] * n_practice + ['unstudied'] * n_practice})
+    practice_recog = recog_list(practice_recog, bias, rng, None, max_run, safe_window)
+    tables['practice_recog'] = practice_recog[['word', 'type', 'safe']]
+
+    tables['practice_source'] = test_list(practice_study[['block', 'word', 'source', 'file']], rng, None, max_run)
+
+    # Main study list
+    study = study_list(target_pool, len(target_pool) // 4, faces['main'], rng, max_run)
+    tables['study'] = study
+
+    # The first and last blocks of the study list are primacy/recency buffers, and aren't tested
+    last = study['block'].max()
+    tested = study[(study['block'] > 1) & (study['block'] < last)].reset_index(drop=True)
+
+    # Recognition test. Lures are assigned to the same blocks as the targets, so the test can begin with the second
+    # block of 4 words, then randomly order trials after that.
+    recog = pd.concat([tested[['block', 'word']].assign(type='studied'),
+                       pd.DataFrame({'block': tested['block'].values,
+                                     'word': lure_pool[:len(tested)],
+                                     'type': 'unstudied'})
+                       ], ignore_index=True)
+    recog = recog_list(recog, bias, rng, 2, max_run, safe_window)
+    recog['trial'] = np.arange(1, len(recog) + 1, dtype=np.int32)
+    tables['recog'] = recog[['block', 'trial', 'word', 'type', 'safe']]
+
+    # Source test, again beginning with the second block of 4 words, and randomly ordering trials after that
+    source = test_list(tested[['block', 'word', 'source', 'file']], rng, 2, max_run)
+    source['trial'] = np.arange(1, len(source) + 1, dtype=np.int32)
+    tables['source'] = source[['block', 'trial', 'word', 'source', 'file']]
+
+    settings = {'max_run': max_run, 'safe_window': safe_window, 'word_rotation': word_rotation, 'face_set': face_set}
+    return Plan(str(subject), seed, bias, n_items, faces, tables, settings)
+
+
+def save_plan(plan, directory='schedules'):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    meta = {'subject': plan.subject, 'seed': plan.seed, 'bias': plan.bias, 'n_items': plan.n_items,
+            'faces': plan.faces, 'settings': plan.settings, 'columns': dict((t, df.columns.tolist()) for t, df in plan.tables.items())}
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for t, df in plan.tables.items():
+        for c in df.columns:
+            values = df[c].values
+            arrays['%s/%s' % (t, c)] = values.astype(np.str_) if values.dtype == object else values
+    path = plan_path(plan.subject, plan.seed, directory)
+    np.savez_compressed(path, **arrays)
+    plan.path = os.path.abspath(path)
+    return path
+
+
+def load_plan(path):
+    with np.load(path) as f:
+        meta = json.loads(str(f['meta']))
+        tables = {}
+        for t, columns in meta['columns'].items():
+            tables[t] = pd.DataFrame(dict((c, f['%s/%s' % (t, c)]) for c in columns))[columns]
+            for c in columns:
+                if tables[t][c].dtype.kind == 'U':
+                    tables[t][c] = tables[t][c].astype(object)
+    plan = Plan(meta['subject'], meta['seed'], meta['bias'], meta['n_items'], meta['faces'], tables,
+                meta.get('settings'))
+    plan.path = os.path.abspath(path)
+    return plan
@@ -0,0 +1,168 @@
+"""Vectorized shuffling, with repair sampling for sequence constraints.
+
+Orders are returned as index arrays (permutations of the rows being shuffled), so they can be applied to any number
+of columns at once. Constraints are enforced by repairing a random order with swaps that respect the grouping of the
+rows, which is much faster than rejecting whole orders when sequences are long. Run limits too tight for the repair to
+meet quickly are met by building the order one position at a time instead (interleave_runs).
+"""
+import numpy as np
+
+
+def permute_within(groups, rng):
+    # A random order of the rows which keeps rows of the same group together, with the groups in sorted order
+    groups = np.asarray(groups)
+    return np.lexsort((rng.random_sample(len(groups)), groups))
+
+
+def runs(labels):
+    # Start positions and lengths of the runs of identical labels in a sequence
+    labels = np.asarray(labels)
+    if not len(labels):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    starts = np.concatenate([[0], np.flatnonzero(labels[1:] != labels[:-1]) + 1])
+    return starts, np.diff(np.append(starts, len(labels)))
+
+
+def longest_run(labels):
+    return runs(labels)[1].max() if len(labels) else 0
+
+
+def _local_ok(seq, positions, max_run):
+    for p in positions:
+        if longest_run(seq[max(0, p - max_run):p + max_run + 1]) > max_run:
+            return False
+    return True
+
+
+def limit_runs(order, labels, max_run, rng, groups=None, max_iter=None):
+    """Repair order so that no more than max_run rows with the same label appear in a row.
+
+    Rows are only swapped with other rows of the same group, so an order made by permute_within stays grouped. Tight
+    limits (e.g. max_run=1) can take the repair a very long time, so after max_iter swaps (one per row by default) the
+    order is built by interleave_runs instead.
+    """
+    order = np.array(order)
+    seq = np.asarray(labels)[order]
+    grp = np.zeros(len(order), dtype=int) if groups is None else np.asarray(groups)[order]
+
+    for _ in range(len(order) if max_iter is None else max_iter):
+        starts, lengths = runs(seq)
+        long_runs = np.flatnonzero(lengths > max_run)
+        if not len(long_runs):
+            return order
+
+        # Move the first row past the limit in a randomly chosen run that is too long
+        p = starts[rng.choice(long_runs)] + max_run
+        candidates = np.flatnonzero((grp == grp[p]) & (seq != seq[p]))
+        if not len(candidates):
+            raise ValueError('Cannot limit runs to %i: no rows to swap with in the same group' % max_run)
+        rng.shuffle(candidates)
+        # Take the first swap which doesn't make a new run that is too long, or any swap at all if none is clean
+        q = candidates[0]
+        for c in candidates[:32]:
+            seq[[p, c]] = seq[[c, p]]
+            clean = _local_ok(seq, (p, c), max_run)
+            seq[[p, c]] = seq[[c, p]]
+            if clean:
+                q = c
+                break
+        seq[[p, q]] = seq[[q, p]]
+        order[[p, q]] = order[[q, p]]
+
+    if longest_run(seq) <= max_run:
+        return order
+    return interleave_runs(order, labels, max_run, rng, groups)
+
+
+def _can_finish(counts, last, run, max_run):
+    # Whether rows with these counts of each label can follow a run of run rows labelled last, without any run longer
+    # than max_run: every label needs enough other rows to break its runs up
+    n = sum(counts.values())
+    for label, count in counts.items():
+        first = max_run - run if label == last else max_run
+        if count > first + max_run * (n - count):
+            return False
+    return True
+
+
+def interleave_runs(order, labels, max_run, rng, groups=None):
+    """Build an order with no more than max_run rows with the same label in a row, one position at a time.
+
+    Each position takes the next row of its group (in the group's positions in order) from a randomly chosen label's
+    queue, weighted by how many rows the label has left, among the labels that keep the rest of the group possible to
+    finish. Works whenever the group's positions are consecutive, as with permute_within, and the limit can be met.
+    """
+    order = np.asarray(order)
+    labels = np.asarray(labels)
+    grp = np.zeros(len(order), dtype=int) if groups is None else np.asarray(groups)[order]
+    queues = {}
+    for g, row in zip(grp, order):
+        queues.setdefault(g, {}).setdefault(labels[row], []).append(row)
+
+    built = np.empty(len(order), dtype=order.dtype)
+    last, run = None, 0
+    for p, g in enumerate(grp):
+        counts = dict((label, len(rows)) for label, rows in queues[g].items() if rows)
+        choices = []
+        for label in sorted(counts):
+            label_run = run + 1 if label == last else 1
+            counts[label] -= 1
+            if label_run <= max_run and _can_finish(counts, label, label_run, max_run):
+                choices.append(label)
+            counts[label] += 1
+        if not choices:
+            raise ValueError('Cannot limit runs to %i with these rows' % max_run)
+        weights = np.array([counts[label] for label in choices], dtype=float)
+        label = choices[rng.choice(len(choices), p=weights / weights.sum())]
+        built[p] = queues[g][label].pop(0)
+        run = run + 1 if label == last else 1
+        last = label
+    return built
+
+
+def window_counts(labels, window, levels):
+    # Number of rows with each label (columns) in each consecutive window of rows (rows)
+    chunk = np.arange(len(labels)) // window
+    codes = np.searchsorted(levels, labels)
+    counts = np.zeros((chunk.max() + 1 if len(labels) else 0, len(levels)), dtype=int)
+    np.add.at(counts, (chunk, codes), 1)
+    return counts
+
+
+def balance_windows(labels, window, rng, groups=None, max_iter=100000):
+    """Repair a sequence of labels so every consecutive window of rows has as close to equal numbers of each label
+    as its size allows.
+
+    Labels are only swapped between rows of the same group, so the number of each label within each group is kept.
+    """
+    labels = np.array(labels)
+    levels = np.unique(labels)
+    grp = np.zeros(len(labels), dtype=int) if groups is None else np.asarray(groups)
+    chunk = np.arange(len(labels)) // window
+    sizes = np.bincount(chunk)
+    target = sizes[:, None] / float(len(levels))
+
+    for _ in range(max_iter):
+        excess = window_counts(labels, window, levels) - target
+        if np.all(np.abs(excess) < 1):
+            return labels
+
+        # Trade a label the fullest window has too many of for one it is short of, with a window where it's the
+        # other way around if there is one
+        c1, a = np.unravel_index(np.argmax(excess), excess.shape)
+        b = np.argmin(excess[c1])
+        others = np.flatnonzero(excess[:, b] > 0)
+        others = others[np.lexsort((rng.random_sample(len(others)), excess[others, a] >= 0))]
+        for c2 in others:
+            i = np.flatnonzero((chunk == c1) & (labels == levels[a]))
+            j = np.flatnonzero((chunk == c2) & (labels == levels[b]))
+            pairs = np.flatnonzero(grp[i][:, None] == grp[j][None, :])
+            if len(pairs):
+                pair = rng.choice(pairs)
+                i, j = i[pair // len(j)], j[pair % len(j)]
+                labels[[i, j]] = labels[[j, i]]
+                break
+        else:
+            break
+
+    raise ValueError('Could not balance labels within windows of %i rows' % window)
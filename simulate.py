@@ -0,0 +1,193 @@
+"""Monte Carlo simulation of how participants following a strategy score on a session's schedule.
+
+Simulated participants behave like the one in headless.py: each studied word is remembered with probability memory,
+and its face with probability source_memory once the word is remembered. A lure is recognized as new with probability
+memory. Anything not remembered is guessed: the safe option with probability safe_bias on the guess and recognition
+screens, and either face at random on source tests. With the repeat guessing policy, an unremembered recognition
+response repeats the trial's guess instead of guessing again.
+
+Whole batches of participants are simulated at once as arrays of participants x trials, scored with a payoff.Payoff,
+and stopped the way main.run stops a session once its total reaches max_points. Session length counts the main study
+list and the two tests (not the practice), with every response taking rt_mean seconds.
+"""
+from __future__ import print_function
+import argparse
+import numpy as np
+import lexicon
+import payoff
+import schedule
+
+# Seconds each kind of trial is shown for, besides the response time (see main.run)
+study_secs = 2 + .5
+study_test_secs = 2 + .5
+recog_secs = 2 + .5
+big_loss_secs = 2
+source_secs = 1 + .25
+
+policies = ['independent', 'repeat']
+
+
+class Trials(object):
+    # A plan's scored trials, in the order main.run presents them
+
+    def __init__(self, plan):
+        study = plan['study']
+        item = dict((w, i) for i, w in enumerate(study['word']))
+        self.n_items = len(study)
+        tests = study.sort_values(['block', 'test_order'], kind='mergesort')
+        self.study_items = tests.index.values
+        # The total is checked at the start of each study block, and the block's words are studied then
+        self.study_checked = tests['test_order'].values == 1
+        block_size = np.bincount(study['block'].values)[tests['block'].values]
+        self.study_fixed = np.where(self.study_checked, block_size * study_secs, 0) + study_test_secs
+
+        recog = plan['recog']
+        self.target = recog['type'].values == 'studied'
+        self.safe_studied = recog['safe'].values == 'studied'
+        self.recog_items = np.array([item.get(w, -1) for w in recog['word']])
+        self.source_items = np.array([item[w] for w in plan['source']['word']])
+
+        # Columns of each test in arrays of all the trials
+        n_study, n_recog = len(self.study_items), len(recog)
+        self.study_columns = slice(0, n_study)
+        self.recog_columns = slice(n_study, n_study + n_recog)
+        self.source_columns = slice(n_study + n_recog, n_study + n_recog + len(self.source_items))
+
+        self.checked = np.concatenate([self.study_checked, np.ones(len(recog) + len(self.source_items), dtype=bool)])
+        self.fixed = np.concatenate([self.study_fixed, np.full(len(recog), recog_secs),
+                                     np.full(len(self.source_items), source_secs)])
+        # Number of responses made on each trial
+        self.responses = np.concatenate([np.ones(len(self.study_items)), np.full(len(recog), 2.0),
+                                         np.ones(len(self.source_items))])
+
+
+def respond(trials, memory, source_memory, safe_bias, policy, rng):
+    """Simulate the responses of one participant per element of the parameter arrays (each an array of shape
+    (participants, 1)). Returns arrays of participants x trials: whether each study list test and source test was
+    correct, and whether each guess and recognition response was "studied".
+    """
+    n = len(memory)
+    remembered = rng.random_sample((n, trials.n_items)) < memory
+    source_known = remembered & (rng.random_sample((n, trials.n_items)) < source_memory)
+
+    def source_correct(items):
+        return source_known[:, items] | (rng.random_sample((n, len(items))) < .5)
+
+    def guess():
+        # Whether each guess is "studied"
+        return (rng.random_sample((n, len(trials.target))) < safe_bias) == trials.safe_studied
+
+    study = source_correct(trials.study_items)
+    guessed = guess()
+    known = np.where(trials.target, remembered[:, trials.recog_items],
+                     rng.random_sample((n, len(trials.target))) < memory)
+    recog = np.where(known, trials.target, guessed if policy == 'repeat' else guess())
+    return {'study': study, 'guess': guessed, 'recog': recog, 'source': source_correct(trials.source_items)}
+
+
+def score(trials, responses, scheme, rt_mean):
+    # The points every trial earned, which trials were run before the session ended early, and how long they took
+    def source_points(correct):
+        return np.where(correct, scheme.source[1], scheme.source[0]).astype(np.int16)
+
+    def recog_points(studied):
+        safe = studied == trials.safe_studied
+        correct = studied == trials.target
+        return scheme.recog.ravel().astype(np.int16).take(safe * np.uint8(2) + correct)
+
+    guess_points, recog_points = recog_points(responses['guess']), recog_points(responses['recog'])
+    points = np.concatenate([source_points(responses['study']), guess_points + recog_points,
+                             source_points(responses['source'])], axis=1)
+    big_loss = np.zeros(points.shape, dtype=bool)
+    big_loss[:, trials.recog_columns] = guess_points + recog_points == scheme.big_loss()
+
+    # A session stops at the first check of its total after it reaches max_points
+    before = np.cumsum(points, axis=1, dtype=np.int32) - points
+    ran = ~np.logical_or.accumulate(trials.checked & (before >= scheme.max_points), axis=1)
+    secs = (trials.fixed + trials.responses * rt_mean + big_loss * big_loss_secs) * ran
+    return points * ran, ran, secs
+
+
+def simulate_batch(trials, memory, source_memory, safe_bias, policy, scheme, rt_mean, rng):
+    # Simulate one participant per element of the parameter arrays. Returns their totals, numbers of trials run, and
+    # session lengths.
+    responses = respond(trials, memory[:, None], source_memory[:, None], safe_bias[:, None], policy, rng)
+    points, ran, secs = score(trials, responses, scheme, rt_mean)
+    return points.sum(axis=1), ran.sum(axis=1), secs.sum(axis=1)
+
+
+def simulate(plans, n, memory=.7, source_memory=.5, safe_bias=.5, policy='independent', scheme=payoff.standard,
+             rt_mean=1.0, seed=None, batch=20000):
+    """Simulate n participants, split evenly across plans. memory, source_memory and safe_bias can be single values,
+    or one value per participant.
+
+    Returns a dict of arrays with every participant's total points, number of trials run, whether their session
+    ended early, and its length in seconds.
+    """
+    if policy not in policies:
+        raise ValueError('policy must be one of %s' % ', '.join(policies))
+    rng = np.random.RandomState(seed)
+    params = [np.broadcast_to(np.asarray(p, dtype=float), (n,)) for p in (memory, source_memory, safe_bias)]
+    plan_trials = [Trials(plan) for plan in plans]
+    which = np.arange(n) % len(plan_trials)
+
+    points, n_trials, secs = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n)
+    for p, trials in enumerate(plan_trials):
+        rows = np.flatnonzero(which == p)
+        for start in range(0, len(rows), batch):
+            chunk = rows[start:start + batch]
+            points[chunk], n_trials[chunk], secs[chunk] = simulate_batch(trials, *[a[chunk] for a in params],
+                                                                         policy=policy, scheme=scheme,
+                                                                         rt_mean=rt_mean, rng=rng)
+    return {'points': points, 'trials': n_trials, 'ended_early': points >= scheme.max_points, 'duration': secs}
+
+
+def summarize(results):
+    points = results['points']
+    quantiles = np.percentile(points, [5, 25, 50, 75, 95])
+    return '\n'.join([
+        "Total points: mean %.1f, sd %.1f, 5/25/50/75/95%% %s" % (points.mean(), points.std(),
+                                                                 '/'.join('%i' % q for q in quantiles)),
+        "Ended early: %.2f%%" % (100 * results['ended_early'].mean()),
+        "Trials run: mean %.1f" % results['trials'].mean(),
+        "Session length: mean %.1f min, 95th percentile %.1f min" % (results['duration'].mean() / 60,
+                                                                      np.percentile(results['duration'], 95) / 60),
+    ])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Simulate participants following a strategy on the session schedules")
+    parser.add_argument("--participants", help="Number of participants to simulate", default=100000, type=int)
+    parser.add_argument("--plans", help="Number of schedules the participants are split across", default=10, type=int)
+    parser.add_argument("--n_items", help="How many words are studied in each session", default=96, type=int)
+    parser.add_argument("--bias", help="Which response option is safe", default='within',
+                        choices=['within'] + schedule.options)
+    parser.add_argument("--words", help="Path to plain text file containing word stimuli, or a lexicon directory",
+                        default='words.txt')
+    parser.add_argument("--memory", help="Probability of remembering a studied word (or rejecting a lure)",
+                        default=.7, type=float)
+    parser.add_argument("--source_memory", help="Probability of remembering the face a remembered word was studied with",
+                        default=.5, type=float)
+    parser.add_argument("--safe_bias", help="Probability of choosing the safe option when guessing",
+                        default=.5, type=float)
+    parser.add_argument("--policy", help="Whether unremembered recognition responses guess again, or repeat the guess",
+                        default='independent', choices=policies)
+    parser.add_argument("--rt_mean", help="Mean response time, in seconds", default=1.0, type=float)
+    parser.add_argument("--seed", help="Seed for the schedules and the participants", default=None, type=int)
+    payoff.Payoff.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.n_items % 4 != 0:
+        raise ValueError('n_items argument value must be a multiple of 4')
+
+    words = lexicon.load_words(args.words)
+    lexicon.check_words(words, args.n_items, args.words)
+    bias = schedule.options if args.bias == 'within' else [args.bias]
+    seeds = np.random.RandomState(args.seed).randint(0, 2**31 - 1, size=args.plans)
+    plans = [schedule.compile_session(words, 'sim', bias, args.n_items, int(seed)) for seed in seeds]
+    scheme = payoff.Payoff.from_arguments(args)
+
+    results = simulate(plans, args.participants, args.memory, args.source_memory, args.safe_bias, args.policy, scheme,
+                       args.rt_mean, args.seed)
+    print(summarize(results))
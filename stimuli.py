@@ -0,0 +1,95 @@
+"""Stimuli rendered ahead of time, so nothing has to be laid out or uploaded right before a timed flip."""
+from collections import OrderedDict
+from psychopy import visual
+
+
+class WordCache(object):
+    """One TextStim per word, looked up with cache[word].
+
+    Words are rendered when prerender() is called during setup, or on first use if they weren't. If size is set, only
+    the size most recently used words are kept, for word pools too big to keep on the GPU at once.
+    """
+
+    def __init__(self, win, size=None, **stim_args):
+        self.win = win
+        self.size = size
+        self.stim_args = stim_args
+        self.stims = OrderedDict()
+
+    def __len__(self):
+        return len(self.stims)
+
+    def __contains__(self, word):
+        return word in self.stims
+
+    def __getitem__(self, word):
+        stim = self.stims.pop(word, None)
+        if stim is None:
+            stim = visual.TextStim(self.win, text=word, **self.stim_args)
+        self.stims[word] = stim
+        if self.size is not None and len(self.stims) > self.size:
+            self.stims.popitem(last=False)
+        return stim
+
+    def prerender(self, words):
+        # Render the words, in the order they'll be used, up to the cache size. Drawing each one once makes sure its
+        # texture is uploaded, and the back buffer is cleared afterwards so none of them end up on screen.
+        words = list(OrderedDict.fromkeys(words))
+        if self.size is not None:
+            words = words[:self.size]
+        for word in reversed(words):
+            self[word].draw()
+        self.win.clearBuffer()
+
+
+def session_words(plan):
+    # Every word a session presents, in the order they first appear
+    tables = ['practice_study', 'practice_recog', 'practice_source', 'study', 'recog', 'source']
+    return list(OrderedDict.fromkeys(w for t in tables for w in plan[t]['word']))
+
+
+def text_rect(win, stim, pad=10):
+    # The region of the window a TextStim covers, as [left, top, right, bottom] in norm units
+    w, h = stim.boundingBox
+    x, y = stim.pos
+    dx = (w / 2.0 + pad) * 2.0 / win.size[0]
+    dy = (h / 2.0 + pad) * 2.0 / win.size[1]
+    return [x - dx, y + dy, x + dx, y - dy]
+
+
+class ScreenCache(object):
+    """Screens (or parts of screens) captured from the back buffer once, so showing one costs a single draw.
+
+    Captures clear the back buffer, so they should only be made when nothing is waiting to be flipped.
+    """
+
+    def __init__(self, win):
+        self.win = win
+        self.screens = {}
+
+    def __contains__(self, key):
+        return key in self.screens
+
+    def __getitem__(self, key):
+        return self.screens[key]
+
+    def add(self, key, stims, rect=None):
+        # Capture the stimuli drawn together. With no rect, the whole screen is captured.
+        rect = [-1, 1, 1, -1] if rect is None else rect
+        pos = ((rect[0] + rect[2]) / 4.0 * self.win.size[0], (rect[1] + rect[3]) / 4.0 * self.win.size[1])
+        self.screens[key] = visual.BufferImageStim(self.win, rect=rect, stim=list(stims), pos=pos)
+        self.win.clearBuffer()
+        return self.screens[key]
+
+    def add_text(self, key, text, values):
+        # Capture a TextStim showing each of the values, under the keys (key, value)
+        for value in values:
+            text.text = str(value)
+            self.add((key, value), [text], text_rect(self.win, text))
+
+    def text(self, text, **stim_args):
+        # A full screen of text, captured the first time it's needed
+        key = ('text', text)
+        if key not in self.screens:
+            self.add(key, [visual.TextStim(self.win, text=text, **stim_args)])
+        return self.screens[key]
@@ -0,0 +1,271 @@
+"""Frame-locked presentation, with a record of every flip.
+
+Durations are counted in frames of the display, instead of waited out with core.wait, so the Python work done while a
+screen is up doesn't add to how long it's shown. Every flip is timestamped, and each trial's flips are summarized
+(number of flips, frames dropped, longest frame) so sessions with bad timing can be found and rejected.
+
+Each trial's latency is broken down too: the time spent drawing, waiting for the flip that shows each new screen to
+return, waiting for the response, and on bookkeeping after it (recording and logging the response). The code marks
+those spans with FrameTimer.span (flips are timed by the timer itself), and each trial's totals go into a fixed-size
+buffer, Latency, which is exported with the session data.
+
+Phases times the steps of starting a session, which run partly in parallel, so startup regressions can be tracked.
+Profile breaks a whole session down by section (wall time, CPU time, memory allocated, and a cProfile profile of each),
+to find which part of a session is slow. NoProfile stands in for it when the session isn't profiled.
+"""
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+import io
+import time
+import timeit
+
+try:
+    process_time = time.process_time
+except AttributeError:
+    process_time = time.clock
+
+# Columns of the per-trial timing summary
+columns = ['table', 'row', 'flips', 'dropped', 'max_interval', 'duration']
+
+# Kinds of span in each trial's latency breakdown, and the columns of the exported breakdown (in seconds)
+span_kinds = ['draw', 'flip', 'response', 'bookkeeping']
+latency_columns = ['table', 'row'] + span_kinds
+flip_span = span_kinds.index('flip')
+
+
+class Latency(object):
+    """Fixed-size buffer of every trial's span totals. Once it's full, each trial overwrites the oldest one, and
+    overwritten counts how many were lost."""
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.tables = [None] * size
+        self.rows = array('l', [0] * size)
+        self.spans = array('d', [0.0] * (size * len(span_kinds)))
+        self.count = 0
+
+    @property
+    def overwritten(self):
+        return max(0, self.count - self.size)
+
+    def add(self, table, row, spans):
+        i = self.count % self.size
+        self.tables[i] = table
+        self.rows[i] = row
+        self.spans[i * len(span_kinds):(i + 1) * len(span_kinds)] = spans
+        self.count += 1
+
+    def records(self):
+        # The buffered trials, oldest first, as tuples of latency_columns
+        n = len(span_kinds)
+        return [(self.tables[i], self.rows[i]) + tuple(self.spans[i * n:(i + 1) * n])
+                for i in (j % self.size for j in range(self.count - min(self.count, self.size), self.count))]
+
+
+class Span(object):
+    # Adds the time spent in a with block to one of a trial's span totals
+
+    def __init__(self, spans, kind):
+        self.spans = spans
+        self.kind = kind
+
+    def __enter__(self):
+        self.t0 = timeit.default_timer()
+
+    def __exit__(self, *exc):
+        self.spans[self.kind] += timeit.default_timer() - self.t0
+
+
+class FrameTimer(object):
+
+    def __init__(self, win, rate=None, latency_size=4096):
+        self.win = win
+        if rate is None:
+            rate = win.getActualFrameRate() or 60.0
+        self.period = 1.0 / rate
+        self.onset = None
+        self.last = None
+        self.locked = False
+        self.trials = []
+        self.latency = Latency(latency_size)
+        self.start()
+
+    def frames(self, secs):
+        return max(1, int(round(secs / self.period)))
+
+    def start(self):
+        # Begin collecting the flips of a new trial
+        self.flips = []
+        self.dropped = 0
+        self.max_interval = 0.0
+        self.spans = array('d', [0.0] * len(span_kinds))
+
+    def end(self, table, row):
+        # Summarize the flips made since start(), and add the summary to the session's timing data
+        summary = {'table': table, 'row': int(row), 'flips': len(self.flips), 'dropped': self.dropped,
+                   'max_interval': self.max_interval,
+                   'duration': self.flips[-1] - self.flips[0] if self.flips else 0.0}
+        self.trials.append(summary)
+        self.latency.add(table, int(row), self.spans)
+        self.start()
+        return summary
+
+    def span(self, kind):
+        # Time a with block as one of span_kinds, e.g. with timer.span('draw'): ...
+        return Span(self.spans, span_kinds.index(kind))
+
+    def _flip(self):
+        t = self.win.flip()
+        # Only flips that were supposed to follow the last one on the next frame can drop frames. The flip after a
+        # screen that waited for a response can't.
+        if self.locked and self.last is not None:
+            interval = t - self.last
+            self.max_interval = max(self.max_interval, interval)
+            self.dropped += max(0, int(round(interval / self.period)) - 1)
+        self.flips.append(t)
+        self.last = t
+        return t
+
+    def flip(self):
+        # Show a new screen
+        t0 = timeit.default_timer()
+        self.onset = self._flip()
+        self.spans[flip_span] += timeit.default_timer() - t0
+        self.locked = False
+        return self.onset
+
+    def hold(self, frames, draw=None):
+        """Keep the screen shown by the last flip() up until the next flip is due, frames frames after it was shown.
+
+        The back buffer's contents are undefined after a flip, so every frame is drawn again with draw (a function
+        drawing the screen, e.g. a cached screen's draw method). Without draw, the screen is held blank.
+        """
+        self.locked = True
+        while self.last + self.period - self.onset < (frames - .5) * self.period:
+            if draw is not None:
+                with self.span('draw'):
+                    draw()
+            self._flip()
+
+    def present(self, frames, draw=None):
+        # Show the screen draw draws for frames frames, or a blank screen without draw
+        if draw is not None:
+            with self.span('draw'):
+                draw()
+        self.flip()
+        self.hold(frames, draw)
+
+
+class Phases(object):
+    # Wall clock time spent in each named phase of starting a session
+
+    def __init__(self):
+        self.t0 = timeit.default_timer()
+        self.times = OrderedDict()
+        self.started = {}
+
+    def start(self, name):
+        self.started[name] = timeit.default_timer()
+
+    def stop(self, name):
+        self.times[name] = self.times.get(name, 0.0) + timeit.default_timer() - self.started.pop(name)
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def report(self):
+        return 'Ready after %.2f s (%s)' % (timeit.default_timer() - self.t0,
+                                            ', '.join('%s %.2f s' % t for t in self.times.items()))
+
+
+class Profile(object):
+    """Wall time, CPU time and memory allocated in each section of a session, and a cProfile profile of each.
+
+    Sections follow one another: begin() ends the current section and starts the next. Allocations are traced with
+    tracemalloc (where it's available), across every thread of the process, and the peak is the most memory traced
+    at once during the section. cProfile only sees the thread that calls begin().
+    """
+
+    def __init__(self):
+        import cProfile
+        self.cProfile = cProfile
+        try:
+            import tracemalloc
+            tracemalloc.start()
+        except ImportError:
+            tracemalloc = None
+        self.tracemalloc = tracemalloc
+        self.sections = OrderedDict()
+        self.profiles = OrderedDict()
+        self.current = None
+
+    def _memory(self):
+        return self.tracemalloc.get_traced_memory() if self.tracemalloc is not None else (0, 0)
+
+    def begin(self, name):
+        self.end()
+        self.current = name
+        if self.tracemalloc is not None and hasattr(self.tracemalloc, 'reset_peak'):
+            self.tracemalloc.reset_peak()
+        self.memory = self._memory()[0]
+        self.profiler = self.cProfile.Profile()
+        self.wall, self.cpu = timeit.default_timer(), process_time()
+        self.profiler.enable()
+
+    def end(self):
+        if self.current is None:
+            return
+        self.profiler.disable()
+        wall, cpu = timeit.default_timer() - self.wall, process_time() - self.cpu
+        memory, peak = self._memory()
+        # A section that comes up again adds to its totals
+        totals = self.sections.setdefault(self.current, {'wall': 0.0, 'cpu': 0.0, 'allocated': 0, 'peak': 0})
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+        totals['allocated'] += memory - self.memory
+        totals['peak'] = max(totals['peak'], peak)
+        self.profiles.setdefault(self.current, []).append(self.profiler)
+        self.current = None
+
+    def report(self, top=10):
+        # A table of the sections, then each section's functions with the most cumulative time
+        import pstats
+        lines = ['%-20s %10s %10s %14s %14s' % ('section', 'wall (s)', 'cpu (s)', 'allocated (kB)', 'peak (kB)')]
+        for name, t in self.sections.items():
+            lines.append('%-20s %10.3f %10.3f %14.1f %14.1f' % (name, t['wall'], t['cpu'], t['allocated'] / 1024.0,
+                                                                t['peak'] / 1024.0))
+        for name, profilers in self.profiles.items():
+            stream = io.StringIO() if str is not bytes else io.BytesIO()
+            stats = pstats.Stats(*profilers, stream=stream)
+            stats.sort_stats('cumulative').print_stats(top)
+            lines += ['', '=== %s ===' % name, stream.getvalue().strip()]
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        # Write the report to path.txt, and the whole session's profile to path.prof (for pstats, snakeviz etc.)
+        import pstats
+        self.end()
+        with open(path + '.txt', 'w') as f:
+            f.write(self.report())
+        profilers = [p for ps in self.profiles.values() for p in ps]
+        if profilers:
+            pstats.Stats(*profilers).dump_stats(path + '.prof')
+
+
+class NoProfile(object):
+    # Does nothing in place of a Profile, so an unprofiled session pays only for the method calls
+
+    def begin(self, name):
+        pass
+
+    def end(self):
+        pass
+
+    def save(self, path):
+        pass
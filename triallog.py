@@ -0,0 +1,165 @@
+import atexit
+import json
+import os
+from writer import Writer
+
+# Response columns (their names in records) recorded on each logged trial list. records and pandas are only imported
+# when a log is replayed, so that main can look for a log before its heavy imports.
+table_columns = {'study': 'study_columns',
+                 'recog': 'recog_columns',
+                 'source': 'source_columns',
+                 }
+
+
+def log_path(subject, directory='data'):
+    return os.path.join(directory, str(subject) + '_trials.jsonl')
+
+
+def _to_json(value):
+    # numpy scalars know how to turn themselves into plain Python values
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class TrialLog(object):
+    """Append-only log of a session's schedules and trial responses, one JSON object per line.
+
+    Entries are serialized and written by a background Writer, so logging never stalls the frame loop. Trials
+    are handed over in batches of `batch`, with an fsync after each batch. Everything else (the session header and the
+    schedules) is handed over immediately. Whatever is still buffered gets flushed when the log is closed, which also
+    happens at interpreter exit (e.g. after core.quit).
+    """
+
+    def __init__(self, path, batch=8, writer=None):
+        self.path = path
+        self.batch = batch
+        self.pending = []
+        self.closed = False
+        self.writer = writer if writer is not None else Writer()
+        self.f = open(path, 'a+')
+        # Start on a fresh line, in case the last session crashed partway through writing one
+        self.f.seek(0, os.SEEK_END)
+        if self.f.tell() > 0:
+            self.f.seek(self.f.tell() - 1)
+            if self.f.read(1) != '\n':
+                self.f.write('\n')
+        atexit.register(self.close)
+
+    def _write(self, entry):
+        self.pending.append(entry)
+
+    def _append(self, entries):
+        # Runs on the writer thread
+        self.f.write(''.join(json.dumps(entry, default=_to_json) + '\n' for entry in entries))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def flush(self):
+        if self.pending and not self.closed:
+            self.writer.submit(self._append, self.pending)
+        self.pending = []
+
+    def close(self):
+        # Hand over whatever is buffered, and wait for the whole log to be written
+        if not self.closed:
+            self.flush()
+            self.closed = True
+            self.writer.submit(self.f.close)
+            self.writer.flush()
+
+    def session(self, subject, bias, n_items, seed=None, settings=None, plan_file=None):
+        # settings are the rest of the arguments the session's plan was compiled with (see schedule.Plan), and
+        # plan_file the file it was saved to or loaded from (e.g. a bundle's), so a resumed session gets the same plan
+        self._write({'event': 'session', 'subject': str(subject), 'bias': list(bias), 'n_items': n_items, 'seed': seed,
+                     'settings': settings or {}, 'plan_file': plan_file})
+        self.flush()
+
+    def startup(self, phases):
+        # Seconds spent in each phase of starting the session
+        self._write({'event': 'startup', 'phases': phases})
+        self.flush()
+
+    def schedule(self, table, frame, **extra):
+        entry = {'event': 'schedule', 'table': table,
+                 'index': frame.index.tolist(), 'index_names': list(frame.index.names),
+                 'columns': frame.columns.tolist(), 'rows': frame.values.tolist()}
+        entry.update(extra)
+        self._write(entry)
+        self.flush()
+
+    def trial(self, table, row, *values):
+        self._write({'event': 'trial', 'table': table, 'row': row, 'values': values})
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def timing(self, summary):
+        # A trial's flip timing summary, from timing.FrameTimer.end
+        entry = {'event': 'timing'}
+        entry.update(summary)
+        self._write(entry)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+
+class LoggedSession(object):
+
+    def __init__(self, header):
+        self.header = header
+        self.tables = {}
+        self.records = {}
+        self.extra = {}
+        self.timing = []
+
+    def has(self, table):
+        return table in self.tables
+
+    def total_points(self):
+        total = 0
+        for r in self.records.values():
+            for name in r.names:
+                if name.endswith('points'):
+                    total += int(r.data[name][r.done].sum())
+        return total
+
+
+def _schedule_frame(entry):
+    import pandas as pd
+    index = entry['index']
+    if len(entry['index_names']) > 1:
+        index = pd.MultiIndex.from_tuples([tuple(i) for i in index], names=entry['index_names'])
+    else:
+        index = pd.Index(index, name=entry['index_names'][0])
+    return pd.DataFrame(entry['rows'], columns=entry['columns'], index=index)
+
+
+def replay(path):
+    # Rebuild the schedules and responses written to a trial log. Returns None if nothing useful was logged.
+    if not os.path.isfile(path):
+        return None
+    import records
+
+    session = None
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partially written line, from a crash in the middle of a write
+                continue
+
+            if entry['event'] == 'session':
+                session = LoggedSession(entry)
+            elif entry['event'] == 'schedule':
+                table = entry['table']
+                session.tables[table] = _schedule_frame(entry)
+                columns = getattr(records, table_columns[table])
+                session.records[table] = records.TrialRecords(len(entry['rows']), columns)
+                session.extra[table] = dict((k, v) for k, v in entry.items()
+                                            if k not in ('event', 'table', 'index', 'index_names', 'columns', 'rows'))
+            elif entry['event'] == 'trial':
+                session.records[entry['table']].record(entry['row'], *entry['values'])
+            elif entry['event'] == 'timing':
+                session.timing.append(dict((k, v) for k, v in entry.items() if k != 'event'))
+
+    return session
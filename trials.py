@@ -1,89 +1,80 @@
-from psychopy.core import Clock
-from psychopy import visual, event
-timer = Clock()
-
-
-def draw_guess_stimuli(factors, studied, studied_rect, unstudied, unstudied_rect):
-
-    if factors.safe == 'studied':
-        studied.color = 'green'
-        unstudied.color = 'red'
-    else:
-        unstudied.color = 'green'
-        studied.color = 'red'
-
-    studied.draw()
-    studied_rect.draw()
-    unstudied.draw()
-    unstudied_rect.draw()
-
-
-def guess_response(factors, mouse, studied_rect, unstudied_rect):
-
-    mouse.setPos((0, -.1))  # Return mouse to near center
-    mouse.setVisible(1)
-
-    timer.reset()
-    resp = None
-    while resp is None:
-        if mouse.isPressedIn(studied_rect, [0]):
-            rt = timer.getTime()
-            resp = 'studied'
-        if mouse.isPressedIn(unstudied_rect, [0]):
-            rt = timer.getTime()
-            resp = 'unstudied'
-
-    # Wait until the mouse is no longer pressed, by doing nothing as long as it is pressed
-    while mouse.getPressed()[0]:
-        pass
-
-    if resp == factors.type and resp == factors.safe:
-        points = 3
-    elif resp == factors.type and resp != factors.safe:
-        points = 1
-    elif resp != factors.type and resp == factors.safe:
-        points = -1
-    else:
-        points = -3
+import payoff
+import responses
+
+# Style of the instruction text
+instruction_style = {'wrapWidth': 1.75, 'height': .085}
+
+
+def capture_buttons(screens, name, texts, rects):
+    # Capture a row of response buttons in every state it's shown in: with either option safe, and active or dimmed.
+    # texts and rects map each option to its label and its outline.
+    win = screens.win
+    bounds = [responses.rect_bounds(r) for r in rects.values()]
+    top = (max(b[3] for b in bounds) + 2) / (win.size[1] / 2.0)
+    bottom = (min(b[2] for b in bounds) - 2) / (win.size[1] / 2.0)
+
+    for safe in ['studied', 'unstudied']:
+        for active in [True, False]:
+            for option in texts:
+                texts[option].color = 'green' if option == safe else 'red'
+                texts[option].contrast = 1 if active else .25
+                rects[option].opacity = 1 if active else .25
+            stims = [stim for option in sorted(texts) for stim in (texts[option], rects[option])]
+            screens.add((name, safe, active), stims, rect=[-1, top, 1, bottom])
+
+
+def draw_buttons(screens, name, factors, active=True):
+    screens[name, factors.safe, active].draw()
+
+
+def guess_response(factors, buttons, scheme=payoff.standard):
+
+    buttons.mouse.setPos((0, -.1))  # Return mouse to near center
+    buttons.mouse.setVisible(1)
+
+    resp, rt = buttons.wait()
+
+    points = int(scheme.recog_points(resp, factors.safe, factors.type))
 
     return resp, rt, points
 
 
-def points_feedback(text, points):
+def points_feedback(screens, name, points):
+
+    screens[name, points].draw()
 
-    text.text = str(points)
-    text.draw()
 
+def draw_guess_feedback(screens, x, points):
+    # The guess buttons, with the points feedback
+    draw_buttons(screens, 'guess', x)
+    points_feedback(screens, 'guess_points', points)
 
-def draw_study_trial(x, word, faces=None):
 
-    word.text = x.word
-    word.draw()
+def draw_study_trial(x, words, faces=None):
+
+    words[x.word].draw()
     if faces is not None:
         faces[x.source].draw()
 
 
-def draw_source_test(x, word, question, options):
+def draw_source_test(x, words, question, options):
 
-    word.text = x.word
-    word.draw()
+    words[x.word].draw()
     question.draw()
     options.draw()
 
 
-def source_test_response(x):
+def source_test_response(x, keys, scheme=payoff.standard):
     response_map = {'z': 'm', 'slash': 'f'}
-    event.clearEvents()
-    timer.reset()
+    keys.clear()
+    onset = keys.now()
 
-    pressed = []
-    while not pressed:
-        pressed = event.getKeys(['z', 'slash'], timeStamped=timer)
+    key, t = keys.wait(onset)
 
-    response = response_map[pressed[0][0]]
-    rt = pressed[0][1]
+    response = response_map[key]
+    rt = t - onset
     correct = True if response == x.source else False
-    points = 2 if correct else -2
+    points = int(scheme.source_points(correct))
 
     return response, rt, correct, points
 
@@ -94,20 +85,60 @@ def draw_source_feedback(x, points, *args):
     points.draw()
 
 
-def draw_recog_stimuli(x, word, *args):
-    draw_guess_stimuli(x, *args)
-    word.text = x.word
-    word.draw()
+def draw_source_test_feedback(x, words, question, options, points):
+    # The source test probe, with the points feedback
+    draw_source_test(x, words, question, options)
+    draw_source_feedback(x, points, words)
+
+
+def draw_recog_stimuli(x, words, screens, active=True):
+    draw_buttons(screens, 'recog', x, active)
+    words[x.word].draw()
+
+
+def recog_trial(x, words, screens, guess_buttons, recog_buttons, timer, scheme=payoff.standard):
+    # Show the guess and recognition screens of a recognition test trial, collect both responses, and give the points
+    # feedback. Returns the responses, their RTs and the points they earned.
+
+    # Draw the guess response buttons, and collect the guess
+    with timer.span('draw'):
+        draw_buttons(screens, 'guess', x)
+        screens['guess_reminder'].draw()
+    timer.flip()
+    with timer.span('response'):
+        guess, guess_rt, guess_points = guess_response(x, guess_buttons, scheme)
+
+    # "Deactivate" the guess response buttons, and draw the recognition probe
+    with timer.span('draw'):
+        draw_buttons(screens, 'guess', x, active=False)
+        draw_recog_stimuli(x, words, screens)
+    timer.flip()
+    with timer.span('response'):
+        recog, recog_rt, recog_points = guess_response(x, recog_buttons, scheme)
+
+    # "Deactivate" the recognition response buttons too, and give the feedback
+    recog_buttons.mouse.setVisible(0)
+
+    def feedback():
+        draw_buttons(screens, 'guess', x, active=False)
+        draw_recog_stimuli(x, words, screens, active=False)
+        points_feedback(screens, 'guess_points', guess_points)
+        points_feedback(screens, 'recog_points', recog_points)
+    timer.present(timer.frames(2), feedback)
+
+    if guess_points + recog_points == scheme.big_loss():
+        timer.present(timer.frames(2), screens['big_loss'].draw)
+
+    return guess, guess_rt, guess_points, recog, recog_rt, recog_points
 
 
-def give_instructions(win, event, text_list):
+def give_instructions(screens, event, text_list, timer):
 
-    instructions = visual.TextStim(win, wrapWidth=1.75, height=.085, text=text_list[0])
-    instructions.draw()
+    # Pages are captured the first time they're shown, and the next page is captured while the current one is read
+    screens.text(text_list[0], **instruction_style).draw()
     for i in range(len(text_list)):
-        win.flip()
+        timer.flip()
         if i < (len(text_list) - 1):
-            instructions.text = text_list[i + 1]
-            instructions.draw()
+            screens.text(text_list[i + 1], **instruction_style).draw()
         event.waitKeys(keyList=['space'])
 
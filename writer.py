@@ -0,0 +1,60 @@
+"""Write session data on a background thread, so serializing and syncing files never holds up a flip."""
+import atexit
+import sys
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class Writer(threading.Thread):
+    """Runs writes (any function and its arguments) one at a time, in the order they were submitted.
+
+    The queue is bounded, so if writing falls far behind, submitting waits instead of queuing without limit. close()
+    waits for everything submitted to be written. It's also called at interpreter exit, so data is flushed when the
+    session ends with core.quit, including from the 'q' shutdown key.
+    """
+
+    def __init__(self, size=1024):
+        threading.Thread.__init__(self, name='writer')
+        # A daemon thread doesn't keep the interpreter alive by itself; close() is what waits for the writes
+        self.daemon = True
+        self.queue = queue.Queue(size)
+        self.errors = []
+        self.closed = False
+        self.start()
+        atexit.register(self.close)
+
+    def submit(self, func, *args, **kwargs):
+        if self.closed:
+            raise ValueError('Writer is closed')
+        self.queue.put((func, args, kwargs))
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception:
+                # Keep writing the rest of the data
+                self.errors.append(sys.exc_info()[1])
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Wait for everything submitted so far to be written
+        if self.is_alive():
+            self.queue.join()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.join()